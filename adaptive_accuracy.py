@@ -0,0 +1,73 @@
+"""
+Accuracy and cost of adaptive time stepping in the dike model.
+
+Evaluates random experiments with DikeNetwork(adaptive_tolerance=...) for a
+range of tolerances, and reports the relative error of the expected annual
+damage and number of deaths (summed over dikes and planning steps) against
+stepping every event through the whole wave, with the share of time steps
+skipped and the run time.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from dike_model_function import DikeNetwork, sample_experiments
+from event_quadrature import expected_totals
+from problem_formulation import EVENT_SEED
+
+
+def adaptive_errors(
+    experiments, tolerances, engine="vectorized", event_seed=EVENT_SEED
+):
+    """Mean and maximum relative error per tolerance of adaptive stepping,
+    with the fraction of time steps it skipped and its run time"""
+    model = DikeNetwork(engine=engine, cache_size=0, event_seed=event_seed)
+    reference = expected_totals(model, experiments)
+
+    rows = []
+    for tolerance in tolerances:
+        model.adaptive_tolerance = tolerance
+        model.event_counts.clear()
+        start = time.perf_counter()
+        totals = expected_totals(model, experiments)
+        row = {"tolerance": tolerance, "seconds": time.perf_counter() - start}
+        for name, total, ref in zip(("EAD", "END"), totals, reference):
+            error = np.abs(total - ref) / np.maximum(np.abs(ref), 1e-300)
+            row[f"{name} mean error"] = error.mean()
+            row[f"{name} max error"] = error.max()
+        counts = model.event_counts
+        steps = counts["time steps"] + counts["time steps skipped"]
+        row["steps skipped"] = counts["time steps skipped"] / max(steps, 1)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="adaptive_accuracy",
+        description="Reports the error of adaptive time stepping",
+    )
+    parser.add_argument("-N", "--num_experiments", type=int, default=500)
+    parser.add_argument(
+        "--tolerances", type=float, nargs="+", default=[0, 0.001, 0.01, 0.05]
+    )
+    parser.add_argument("--engine", default="vectorized")
+    parser.add_argument("--seed", type=int, default=1361)
+    parser.add_argument(
+        "--event_seed",
+        type=int,
+        default=EVENT_SEED,
+        help="seed of the flood events of the model (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="also write the table to this csv file")
+    args = parser.parse_args()
+
+    model = DikeNetwork(cache_size=0, event_seed=args.event_seed)
+    experiments = sample_experiments(model, args.num_experiments, args.seed)
+    errors = adaptive_errors(experiments, args.tolerances, args.engine, args.event_seed)
+
+    print(errors.to_string(index=False))
+    if args.output:
+        errors.to_csv(args.output, index=False)
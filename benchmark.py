@@ -0,0 +1,310 @@
+"""
+Benchmarks of the dike model and of the hot paths of the analysis.
+
+Every benchmark runs a fixed workload with fixed seeds, times it (best and
+median of --repeat runs) and checks its output against the golden values in
+data/benchmark_golden.json, so that a speedup that changes the expected
+annual damage or number of deaths fails instead of passing silently. The
+timings and checks are written to a json file (--output), which --compare
+reads back to show the change against an earlier run, e.g. of another
+commit. The exit status is 1 when an output differs from its golden value.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+from scipy.spatial.distance import pdist, squareform
+
+import funs_generate_network
+from dike_model_function import DikeNetwork, sample_experiments
+from funs_hydrostat import werklijn_cdf, werklijn_inv
+from set_diversity import find_maxdiverse
+
+GOLDEN_FILE = "./data/benchmark_golden.json"
+
+# Model calls per policy benchmark:
+N_CALLS = 20
+
+
+def _policy_levers(model, increase=0, rfr=0, days_to_threat=0):
+    """Levers of a policy that takes the same action at every dike, project
+    and planning step"""
+    levers = {"EWS_DaysToThreat": days_to_threat}
+    for s in model.planning_steps:
+        for dike in model.dikelist:
+            levers[f"{dike}_DikeIncrease {s}"] = increase
+        for project in model.network.rfr_projects:
+            levers[f"{project}_RfR {s}"] = rfr
+    return levers
+
+
+def _model_calls(engine, levers, **uncertainties):
+    """Benchmark of N_CALLS model calls, with random scenarios (of which
+    uncertainties overrides some) and fixed levers, set with the model"""
+
+    def setup():
+        model = DikeNetwork(
+            engine=engine, cache_size=0, event_set="stratified", num_events=30
+        )
+        scenarios = sample_experiments(model, N_CALLS, seed=1361)
+        experiments = []
+        for scenario in scenarios.to_dict("records"):
+            scenario.update(levers(model))
+            for key, value in uncertainties.items():
+                for dike in model.dikelist:
+                    scenario[f"{dike}_{key}"] = value
+            experiments.append(scenario)
+        model.warm_up()
+
+        def run():
+            names = {
+                metric: [f"{dike}_{metric}" for dike in model.dikelist]
+                for metric in (
+                    "Expected Annual Damage",
+                    "Expected Number of Deaths",
+                    "Dike Investment Costs",
+                )
+            }
+            totals = {metric: [] for metric in names}
+            for kwargs in experiments:
+                outcomes = model(**kwargs)
+                for metric, keys in names.items():
+                    totals[metric].append(float(outcomes.sum(keys)))
+            return totals
+
+        return run
+
+    return setup
+
+
+def _network_startup():
+    def run():
+        G, dikes, _, steps = funs_generate_network.get_network(3)
+        return {"nodes": G.number_of_nodes(), "dikes": len(dikes)}
+
+    return run
+
+
+def _model_startup():
+    def run():
+        model = DikeNetwork(event_set="stratified", num_events=30)
+        return {
+            "Qpeaks": float(model.Qpeaks.sum()),
+            "wave_response": float(model.network.wave_response.sum()),
+        }
+
+    return run
+
+
+def _werklijn(size=10**6):
+    def setup():
+        A = funs_generate_network.read_sources()["werklijn_params"]
+        rng = np.random.default_rng(1361)
+        Q = rng.uniform(0, 25000, size)
+        P = rng.uniform(0, 1, size)
+
+        def run():
+            cdf = werklijn_cdf(Q, A)
+            inv = werklijn_inv(P, A)
+            return {
+                "cdf": float(np.nansum(cdf)),
+                "inv": float(np.nansum(inv[np.isfinite(inv)])),
+                "nan": int(np.isnan(cdf).sum() + np.isnan(inv).sum()),
+            }
+
+        return run
+
+    return setup
+
+
+def _maxdiverse(n_combinations=2 * 10**6, n_scenarios=500):
+    """find_maxdiverse on sets of three random scenarios and a fixed worst
+    case, as in open_exploration__scenario_diversity_scoring.py"""
+
+    def setup():
+        rng = np.random.default_rng(1361)
+        distances = squareform(pdist(rng.uniform(size=(n_scenarios, 3))))
+        sampler = random.Random(1361)
+        indices = list(range(1, n_scenarios))
+        combinations = [
+            tuple(sampler.sample(indices, 3)) + (0,) for _ in range(n_combinations)
+        ]
+
+        def run():
+            scores = find_maxdiverse(distances, combinations)
+            diversity = np.array([score[0][0] for score in scores])
+            best = int(diversity.argmax())
+            return {
+                "sum": float(diversity.sum()),
+                "max": float(diversity[best]),
+                "best": list(scores[best][1]),
+            }
+
+        return run
+
+    return setup
+
+
+def benchmarks(engine):
+    """Setup function of every benchmark, by name; calling it prepares the
+    workload and returns the function to time, which returns the outputs
+    that are checked against the golden values"""
+    return {
+        "network startup": _network_startup,
+        "model startup": _model_startup,
+        "call do nothing": _model_calls(engine, _policy_levers),
+        "call heavy breach": _model_calls(
+            engine, _policy_levers, pfail=0.01, Bmax=350, Brate=10
+        ),
+        "call max protection": _model_calls(
+            engine,
+            lambda model: _policy_levers(model, increase=10, rfr=1, days_to_threat=4),
+        ),
+        "werklijn": _werklijn(),
+        "find_maxdiverse": _maxdiverse(),
+    }
+
+
+def _mismatches(output, golden, rtol):
+    """Keys of output that differ from golden"""
+    return [
+        key
+        for key, value in output.items()
+        if key not in golden
+        or np.shape(value) != np.shape(golden[key])
+        or not np.allclose(value, golden[key], rtol=rtol, atol=0)
+    ]
+
+
+def run_benchmarks(names, engine="vectorized", repeat=3, golden=None, rtol=1e-9):
+    """Time the named benchmarks and check their outputs against golden.
+
+    Returns the results per benchmark: the seconds of every run, the best
+    and median, the outputs and the golden check ('ok', 'missing' or
+    'FAILED' with the mismatching keys)."""
+    golden = golden or {}
+    setups = benchmarks(engine)
+    results = {}
+    for name in names:
+        run = setups[name]()
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = run()
+            seconds.append(time.perf_counter() - start)
+
+        result = {
+            "seconds": seconds,
+            "best": min(seconds),
+            "median": float(np.median(seconds)),
+            "output": output,
+        }
+        if name not in golden:
+            result["golden"] = "missing"
+        else:
+            mismatches = _mismatches(output, golden[name], rtol)
+            result["golden"] = "FAILED" if mismatches else "ok"
+            if mismatches:
+                result["mismatches"] = mismatches
+        results[name] = result
+        print(f"{name:>20}: {result['best']:9.4f} s  {result['golden']}")
+    return results
+
+
+def _commit():
+    """Short hash of the checked out commit, if this is a git repository"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Table of the best times of two result files, and their ratio"""
+    lines = [f"{'benchmark':>20}  {'old':>9}  {'new':>9}  speedup"]
+    for name, result in new["benchmarks"].items():
+        if name in old["benchmarks"]:
+            before = old["benchmarks"][name]["best"]
+            lines.append(
+                f"{name:>20}  {before:9.4f}  {result['best']:9.4f}  "
+                f"{before / result['best']:6.2f}x"
+            )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        description="Times the dike model and analysis hot paths and checks "
+        "their outputs against golden values",
+    )
+    parser.add_argument(
+        "names", nargs="*", help="benchmarks to run (default: all)", default=None
+    )
+    parser.add_argument("--engine", default="vectorized", choices=DikeNetwork.engines)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    parser.add_argument(
+        "--output", help="results file (default: output/benchmark__<commit>.json)"
+    )
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument(
+        "--update_golden",
+        action="store_true",
+        help="store the outputs of this run as the golden values",
+    )
+    args = parser.parse_args()
+
+    names = args.names or list(benchmarks(args.engine))
+    unknown = set(names) - set(benchmarks(args.engine))
+    if unknown:
+        parser.error(f"unknown benchmarks {sorted(unknown)}")
+
+    golden = {}
+    if os.path.exists(GOLDEN_FILE):
+        with open(GOLDEN_FILE) as f:
+            golden = json.load(f)
+
+    results = run_benchmarks(
+        names, args.engine, args.repeat, {} if args.update_golden else golden, args.rtol
+    )
+
+    commit = _commit()
+    report = {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "engine": args.engine,
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+    output = args.output or f"./output/benchmark__{commit or 'unknown'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"results written to {output}")
+
+    if args.update_golden:
+        golden.update({name: result["output"] for name, result in results.items()})
+        with open(GOLDEN_FILE, "w") as f:
+            json.dump(golden, f, indent=1)
+        print(f"golden values written to {GOLDEN_FILE}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), report))
+
+    if any(result["golden"] == "FAILED" for result in results.values()):
+        sys.exit(1)
@@ -3,17 +3,90 @@ Created on Tue Oct 31 13:18:05 2017
 
 @author: ciullo
 """
+import contextlib
 import copy
+import functools
+import hashlib
+import multiprocessing.util
+import os
 import numpy as np
 import pandas as pd
-from collections import defaultdict
+from collections import Counter, namedtuple
+from collections.abc import Mapping
 
 from ema_workbench import ema_logging
 
+import funs_cache
+import funs_dikes
+import funs_economy
 import funs_generate_network
-from funs_dikes import Lookuplin, dikefailure, init_node
-from funs_economy import cost_fun, discount, cost_evacuation
-from funs_hydrostat import werklijn_cdf, werklijn_inv
+import funs_hydrostat
+import funs_interp
+import funs_kernel
+import funs_outcomes
+import funs_profile
+import funs_shared_memory
+from funs_dikes import Lookuplin, dikefailure, dikefailure_vec, init_node
+from funs_economy import annuity_factor, cost_fun, cost_evacuation
+from funs_hydrostat import Werklijn, event_set
+from funs_outcomes import Outcomes, outcome_names
+
+# Inputs of the array engines, bound from the parameters of a block of
+# experiments by DikeNetwork._bind; per experiment, step and dike:
+BoundExperiments = namedtuple(
+    "BoundExperiments",
+    [
+        "wave_ids",
+        "Bmax",
+        "Brate",
+        "critWL",
+        "wl_shift",
+        "dikecosts",
+        "rfr_costs",
+        "rates",
+        "days_to_threat",
+        "evacuation_percentage",
+    ],
+)
+
+# A single experiment simulated with DikeNetwork.evaluate_chain, which
+# evaluate_incremental re-evaluates from: its parameters and bound inputs,
+# the outflow of every dike, (steps, events, dikes, time), the maximum water
+# level and breach status, (steps, events, dikes), and its outcomes.
+ChainState = namedtuple(
+    "ChainState",
+    [
+        "parameters",
+        "timestep",
+        "Qpeaks",
+        "bound",
+        "Qout",
+        "wlmax",
+        "status",
+        "outcomes",
+    ],
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _source_digest():
+    """Hash of the code of the model and of its data files"""
+    digest = hashlib.sha256()
+    modules = (
+        funs_dikes,
+        funs_economy,
+        funs_generate_network,
+        funs_hydrostat,
+        funs_interp,
+        funs_kernel,
+        funs_outcomes,
+    )
+    for path in [__file__] + [module.__file__ for module in modules]:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    files = funs_generate_network._source_files()
+    digest.update(funs_generate_network._content_hash(files).encode())
+    return digest.hexdigest()
 
 
 def Muskingum(C1, C2, C3, Qn0_t1, Qn0_t0, Qn1_t0):
@@ -23,10 +96,56 @@ def Muskingum(C1, C2, C3, Qn0_t1, Qn0_t0, Qn1_t0):
 
 
 class DikeNetwork:
-    def __init__(self):
+    """IJssel dike network model
+
+    Parameters
+    ----------
+    engine : str
+             'vectorized' (default) advances all events and planning steps
+             together as arrays, 'scalar' simulates one event at a time,
+             'compiled' runs the numba kernel of funs_kernel (falls back to
+             'vectorized' when numba is not installed)
+    cache_size : int
+                 bytes of memory for the results of simulated events that
+                 the array engines reuse across calls (see funs_cache), 0
+                 disables the cache
+    event_set, num_events, event_seed : str, int, int
+                 flood events to integrate over, see set_events
+    adaptive_tolerance : float, optional
+                 stop time-stepping an event once the rest of the wave can
+                 no longer breach a dike nor raise the water level at a
+                 breached dike by more than this many meters, judged by
+                 the water levels of the wave without breaches; by default
+                 every event runs to the end of the wave. This is not a
+                 strict bound: it ignores the inflow that upstream
+                 breaches add or remove, and the routing of the reaches
+                 with a negative Muskingum C3 does not keep a lower
+                 inflow below the no-breach levels, so even a tolerance
+                 of 0 is not exact in general
+    """
+
+    engines = ("vectorized", "scalar", "compiled")
+
+    def __init__(
+        self,
+        engine="vectorized",
+        cache_size=32 * 2**20,
+        event_set="random",
+        num_events=30,
+        event_seed=None,
+        adaptive_tolerance=None,
+    ):
+        if engine not in self.engines:
+            raise ValueError(f"unknown engine {engine!r}, use one of {self.engines}")
+        if engine == "compiled" and not funs_kernel.HAS_NUMBA:
+            ema_logging.get_rootlogger().warning(
+                "numba not installed, using the vectorized engine"
+            )
+            engine = "vectorized"
+        self.engine = engine
+
         # planning steps
         self.num_planning_steps = 3
-        self.num_events = 30
 
         # load network
         G, dike_list, dike_branch, planning_steps = funs_generate_network.get_network(
@@ -34,17 +153,10 @@ class DikeNetwork:
         )
 
         # Load hydrological statistics:
-        self.A = pd.read_excel("./data/hydrology/werklijn_params.xlsx")
+        self.A = funs_generate_network.read_sources()["werklijn_params"]
+        self.werklijn = Werklijn(self.A)
 
-        lowQ, highQ = werklijn_inv([0.992, 0.99992], self.A)
-        self.Qpeaks = np.unique(
-            np.asarray(
-                [np.random.uniform(lowQ, highQ) / 6 for _ in range(0, self.num_events)]
-            )
-        )[::-1]
-
-        # Probabiltiy of exceedence for the discharge @ Lobith (i.e. times 6)
-        self.p_exc = 1 - werklijn_cdf(self.Qpeaks * 6, self.A)
+        self.set_events(event_set, num_events, event_seed)
 
         self.G = G
         self.dikelist = dike_list
@@ -64,8 +176,165 @@ class DikeNetwork:
         # Time step correction: Q is a mean daily value expressed in m3/s
         self.timestepcorr = 24 * 60 * 60
 
+        # Static network compiled into read-only arrays for the array
+        # engines, and their reusable simulation state:
+        self.network = funs_generate_network.compile_network(G, dike_list)
+        self.policy_tables = funs_generate_network.compile_policy_tables(
+            self.network, self.dh, self.num_planning_steps
+        )
+        self._workspace = None
+        # Number of events evaluated by the array engines, and of those the
+        # ones pruned without simulation, repeating an earlier planning step
+        # or time-stepped (see _simulate and _evaluate_block):
+        self.event_counts = Counter()
+        self.adaptive_tolerance = adaptive_tolerance
+        # Results of simulated events, reused across calls:
+        self.event_cache = funs_cache.EventCache(cache_size)
+        # Handles of the network and policy tables in shared memory, see
+        # shared_memory():
+        self._shared_network = None
+        self._shared_tables = None
+        # Time per phase of the evaluations, see enable_profiling():
+        self.profile = None
+
+        # Names of all uncertainties and levers the model accepts:
+        self._parameter_names = {"A.0_ID flood wave shape", "EWS_DaysToThreat"}
+        for s in planning_steps:
+            self._parameter_names.add(f"discount rate {s}")
+            self._parameter_names.update(
+                f"{p}_RfR {s}" for p in self.network.rfr_projects
+            )
+            self._parameter_names.update(
+                f"{dike}_DikeIncrease {s}" for dike in dike_list
+            )
+        for dike in dike_list:
+            self._parameter_names.update(
+                f"{dike}_{key}" for key in ("Bmax", "pfail", "Brate")
+            )
+
+        # Names of the outcomes, in the order of their buffers (see
+        # funs_outcomes):
+        self.outcome_names = outcome_names(dike_list)
+
     #        ema_logging.info('model initialized')
 
+    def __getstate__(self):
+        # the workspace is scratch memory, no need to send it to workers,
+        # which count their own events
+        state = self.__dict__.copy()
+        state["_workspace"] = None
+        state["event_counts"] = Counter()
+
+        # with the network in shared memory, workers attach to it instead
+        # of receiving their own copy (the graph is only used by the
+        # scalar engine)
+        if self._shared_network is not None:
+            state["network"] = None
+            state["policy_tables"] = None
+            if self.engine != "scalar":
+                state["G"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shared_network is not None:
+            self.network = funs_shared_memory.attach(self._shared_network)
+            self.policy_tables = funs_shared_memory.attach(self._shared_tables)
+            self.warm_up()
+
+    @contextlib.contextmanager
+    def shared_memory(self):
+        """Publish the compiled network and policy tables in shared memory
+        while the context is open. Pickled copies of the model, like the
+        ones sent to the workers of a MultiprocessingEvaluator, then attach
+        to that memory instead of carrying their own copy of the network,
+        and warm up before their first experiment.
+
+        With the fork start method workers already share the parent's
+        memory and nothing is pickled; the context is then harmless."""
+        self._shared_network, shm = funs_shared_memory.publish(self.network)
+        self._shared_tables, tables_shm = funs_shared_memory.publish(self.policy_tables)
+        try:
+            yield self
+        finally:
+            self._shared_network = self._shared_tables = None
+            funs_shared_memory.release(shm)
+            funs_shared_memory.release(tables_shm)
+
+    def enable_profiling(self, directory=None, interval=5.0):
+        """Record the wall time and number of calls of every phase of the
+        evaluations (see funs_profile.PHASES) in self.profile.
+
+        With a directory, every process that evaluates a copy of the model,
+        like the workers of a MultiprocessingEvaluator, writes its totals
+        and event counts there (see funs_profile.PhaseProfile.dump); read
+        them with funs_profile.report(directory). Files of an earlier run
+        in directory are removed.
+        """
+        if directory is not None:
+            funs_profile.clear(directory)
+        self.profile = funs_profile.PhaseProfile(directory, interval)
+        return self.profile
+
+    def _profiled(self):
+        """self.profile, started anew when the model is evaluated in a new
+        (forked or spawned) worker process"""
+        profile = self.profile
+        if profile is not None and profile.pid != os.getpid():
+            profile.reset()
+            self.event_counts.clear()
+            multiprocessing.util.Finalize(
+                None, profile.dump, args=(self.event_counts,), exitpriority=10
+            )
+        return profile
+
+    def set_events(self, method="random", num_events=30, seed=None):
+        """Choose the flood events that the expected annual damage, number
+        of deaths and evacuation costs are integrated over.
+
+        The default draws num_events peak discharges at random, without a
+        seed a different set in every process. See funs_hydrostat.event_set
+        for the deterministic alternatives, which need fewer events for the
+        same accuracy (run event_quadrature.py to compare them).
+        """
+        self.event_method = method
+        self.num_events = num_events
+        self.Qpeaks, self.p_exc, self.event_weights = event_set(
+            self.werklijn, num_events, method, seed
+        )
+
+    def version(self):
+        """Hash of all that the outcomes depend on besides the uncertainties
+        and levers: the code and data files of the model, its flood events
+        and its settings. The engines agree up to rounding and are left
+        out."""
+        digest = hashlib.sha256(_source_digest().encode())
+        for values in (self.Qpeaks, self.event_weights):
+            digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+        settings = (
+            self.sb,
+            self.n,
+            self.num_planning_steps,
+            self.dh,
+            self.timestepcorr,
+            self.adaptive_tolerance,
+        )
+        digest.update(repr(settings).encode())
+        return digest.hexdigest()
+
+    def warm_up(self):
+        """Run one do-nothing experiment, so that the compiled kernel is
+        loaded and the workspace allocated before the first real one. The
+        run is left out of the profile, the event counts and the event
+        cache."""
+        profile, counts, cache = self.profile, self.event_counts, self.event_cache
+        self.profile, self.event_counts = None, Counter()
+        self.event_cache = funs_cache.EventCache(0)
+        try:
+            self(**{name: 0 for name in self._parameter_names})
+        finally:
+            self.profile, self.event_counts, self.event_cache = profile, counts, cache
+
     # Initialize hydrology at each node:
     def _initialize_hydroloads(self, node, time, Q_0):
         node["cumVol"], node["wl"], node["Qpol"], node["hbas"] = (
@@ -93,88 +362,39 @@ class DikeNetwork:
         return G
 
     def progressive_height_and_costs(self, G, dikenodes, steps):
-        for dike in dikenodes:
-            node = G.nodes[dike]
-            # Rescale according to step and tranform in meters
-            for s in steps:
-                node[f"DikeIncrease {s}"] *= self.dh
-                # 1 Initialize fragility curve
-                # 2 Shift it to the degree of dike heigthening:
-                # 3 Calculate cumulative raising
-
-                node[f"fnew {s}"] = copy.deepcopy(node["f"])
-                node[f"dikeh_cum {s}"] = 0
-
-                for ss in steps[steps <= s]:
-                    node[f"fnew {s}"][:, 0] += node[f"DikeIncrease {ss}"]
-                    node[f"dikeh_cum {s}"] += node[f"DikeIncrease {ss}"]
-
-                # Calculate dike heigheting costs:
-                if node[f"DikeIncrease {s}"] == 0:
-                    node[f"dikecosts {s}"] = 0
-                else:
-                    node[f"dikecosts {s}"] = cost_fun(
-                        node["traj_ratio"],
-                        node["c"],
-                        node["b"],
-                        node["lambda"],
-                        node[f"dikeh_cum {s}"],
-                        node[f"DikeIncrease {s}"],
-                    )
-
-    def __call__(self, timestep=1, **kwargs):
-
-        G = copy.deepcopy(self.G)
-        Qpeaks = self.Qpeaks
-        dikelist = self.dikelist
-
-        # Call RfR initialization:
-        self._initialize_rfr_ooi(G, dikelist, self.planning_steps)
-
-        # Load all kwargs into network. Kwargs are uncertainties and levers:
-        for item in kwargs:
-            # when item is 'discount rate':
-            if "discount rate" in item:
-                G.nodes[item]["value"] = kwargs[item]
-            # the rest of the times you always get a string like {}_{}:
-            else:
-                string1, string2 = item.split("_")
-
-                if "RfR" in string2:
-                    # string1: projectID
-                    # string2: rfr #step
-                    # Note: kwargs[item] in this case can be either 0
-                    # (no project) or 1 (yes project)
-                    temporal_step = string2.split(" ")[1]
+        """Rescale the dike increases to meters, shift the fragility curves
+        by the cumulative heightening and compute the heightening costs,
+        for all dikes and planning steps at once"""
+        nodes = [G.nodes[dike] for dike in dikenodes]
 
-                    proj_node = G.nodes[f"RfR_projects {temporal_step}"]
-                    # Cost of RfR project
-                    proj_node["cost"] += (
-                        kwargs[item] * proj_node[string1]["costs_1e6"] * 1e6
-                    )
-
-                    # Iterate over the location affected by the project
-                    for key in proj_node[string1].keys():
-                        if key != "costs_1e6":
-                            # Change in rating curve due to the RfR project
-                            G.nodes[key]["rnew"][:, 1] -= (
-                                kwargs[item] * proj_node[string1][key]
-                            )
-                else:
-                    # string1: dikename or EWS
-                    # string2: name of uncertainty or lever
-                    G.nodes[string1][string2] = kwargs[item]
+        # Heightening and cumulative heightening in meters, (dikes, steps):
+        increase = self.dh * np.array(
+            [[node[f"DikeIncrease {s}"] for s in steps] for node in nodes],
+            dtype=float,
+        )
+        cumulative = np.cumsum(increase, axis=1)
 
-        self.progressive_height_and_costs(G, dikelist, self.planning_steps)
+        # Costs of every dike and step, zero for steps without heightening:
+        params = np.array(
+            [[node[k] for k in ("traj_ratio", "c", "b", "lambda")] for node in nodes]
+        )
+        costs = cost_fun(*params.T[..., None], cumulative, increase)
+        costs[increase == 0] = 0
 
-        # Percentage of people who can be evacuated for a given warning
-        # time:
-        G.nodes["EWS"]["evacuation_percentage"] = G.nodes["EWS"]["evacuees"][
-            G.nodes["EWS"]["DaysToThreat"]
-        ]
+        for n, node in enumerate(nodes):
+            for i, s in enumerate(steps):
+                node[f"DikeIncrease {s}"] = increase[n, i]
+                node[f"dikeh_cum {s}"] = cumulative[n, i]
+                node[f"fnew {s}"] = node["f"].copy()
+                node[f"fnew {s}"][:, 0] += cumulative[n, i]
+                node[f"dikecosts {s}"] = costs[n, i]
 
-        # Dictionary storing outputs:
-        data = defaultdict(list)
+    def _simulate_events(self, G, timestep):
+        """Simulate every event of every planning step one scalar at a time,
+        storing losses, deaths and evacuation costs per event on the dike
+        nodes"""
+        Qpeaks = self.Qpeaks
+        dikelist = self.dikelist
 
         for s in self.planning_steps:
             for Qpeak in Qpeaks:
@@ -249,10 +469,17 @@ class DikeNetwork:
                             node["tbreach"] = res[3]
 
                             # Evaluate the volume inside the floodplain as the integral
-                            # of Q in time up to time t.
+                            # of Q in time up to time t: np.trapz over the whole,
+                            # zero-initialized Qpol, carried as a running sum (minus
+                            # half the last value at the end of the wave).
                             node["cumVol"][t] = (
-                                np.trapz(node["Qpol"]) * self.timestepcorr
+                                node["cumVol"][t - 1]
+                                + node["Qpol"][t] * self.timestepcorr
                             )
+                            if t == len(time) - 1:
+                                node["cumVol"][t] -= (
+                                    0.5 * node["Qpol"][t] * self.timestepcorr
+                                )
 
                             Area = Lookuplin(node["table"], 4, 0, node["wl"][t])
                             node["hbas"][t] = node["cumVol"][t] / float(Area)
@@ -260,6 +487,12 @@ class DikeNetwork:
                         elif node["type"] == "downstream":
                             node["Qin"] = G.nodes[dikelist[n - 1]]["Qout"]
 
+                self.event_counts["events"] += 1
+                self.event_counts["time-stepped"] += 1
+                self.event_counts["time steps"] += len(time) - 1
+                if any(G.nodes[dike]["status"][-1] for dike in self.dikelist):
+                    self.event_counts["breached"] += 1
+
                 # Iterate over the network and store outcomes of interest for a
                 # given event
                 for dike in self.dikelist:
@@ -289,32 +522,1030 @@ class DikeNetwork:
                         node[f"deaths {s}"].append(0)
                         node[f"evacuation_costs {s}"].append(0)
 
+    def _call_graph(self, timestep, **kwargs):
+        """__call__ of the scalar engine, on a copy of the network graph"""
+        profile = self._profiled()
+        if profile:
+            profile.start()
+        G = copy.deepcopy(self.G)
+        dikelist = self.dikelist
+        if profile:
+            profile.lap("graph copy")
+
+        # Call RfR initialization:
+        self._initialize_rfr_ooi(G, dikelist, self.planning_steps)
+        if profile:
+            profile.lap("rfr init")
+
+        # Load all kwargs into network. Kwargs are uncertainties and levers:
+        for item in kwargs:
+            # when item is 'discount rate':
+            if "discount rate" in item:
+                G.nodes[item]["value"] = kwargs[item]
+            # the rest of the times you always get a string like {}_{}:
+            else:
+                string1, string2 = item.split("_")
+
+                if "RfR" in string2:
+                    # string1: projectID
+                    # string2: rfr #step
+                    # Note: kwargs[item] in this case can be either 0
+                    # (no project) or 1 (yes project)
+                    temporal_step = string2.split(" ")[1]
+
+                    proj_node = G.nodes[f"RfR_projects {temporal_step}"]
+                    # Cost of RfR project
+                    proj_node["cost"] += (
+                        kwargs[item] * proj_node[string1]["costs_1e6"] * 1e6
+                    )
+
+                    # Iterate over the location affected by the project
+                    for key in proj_node[string1].keys():
+                        if key != "costs_1e6":
+                            # Change in rating curve due to the RfR project
+                            G.nodes[key]["rnew"][:, 1] -= (
+                                kwargs[item] * proj_node[string1][key]
+                            )
+                else:
+                    # string1: dikename or EWS
+                    # string2: name of uncertainty or lever
+                    G.nodes[string1][string2] = kwargs[item]
+        if profile:
+            profile.lap("binding")
+
+        self.progressive_height_and_costs(G, dikelist, self.planning_steps)
+        if profile:
+            profile.lap("heights and costs")
+
+        # Percentage of people who can be evacuated for a given warning
+        # time:
+        G.nodes["EWS"]["evacuation_percentage"] = G.nodes["EWS"]["evacuees"][
+            G.nodes["EWS"]["DaysToThreat"]
+        ]
+
+        # Simulate all events for every planning step:
+        self._simulate_events(G, timestep)
+        if profile:
+            profile.lap("routing")
+
+        # Buffer storing outputs:
+        data = Outcomes.empty(dikelist, len(self.planning_steps))
+
+        for i, s in enumerate(self.planning_steps):
             EECosts = []
             # Iterate over the network,compute and store ooi over all events
             for dike in dikelist:
                 node = G.nodes[dike]
 
                 # Expected Annual Damage:
-                EAD = np.trapz(node[f"losses {s}"], self.p_exc)
+                EAD = np.dot(node[f"losses {s}"], self.event_weights)
                 # Discounted annual risk per dike ring:
-                disc_EAD = np.sum(
-                    discount(
-                        EAD, rate=G.nodes[f"discount rate {s}"]["value"], n=self.y_step
-                    )
+                disc_EAD = EAD * annuity_factor(
+                    G.nodes[f"discount rate {s}"]["value"], self.y_step
                 )
 
                 # Expected Annual number of deaths:
-                END = np.trapz(node[f"deaths {s}"], self.p_exc)
+                END = np.dot(node[f"deaths {s}"], self.event_weights)
 
                 # Expected Evacuation costs: depend on the event, the higher
                 # the event, the more people you have got to evacuate:
-                EECosts.append(np.trapz(node[f"evacuation_costs {s}"], self.p_exc))
+                EECosts.append(
+                    np.dot(node[f"evacuation_costs {s}"], self.event_weights)
+                )
 
-                data[f"{dike}_Expected Annual Damage"].append(disc_EAD)
-                data[f"{dike}_Expected Number of Deaths"].append(END)
-                data[f"{dike}_Dike Investment Costs"].append(node[f"dikecosts {s}"])
+                data[f"{dike}_Expected Annual Damage"][i] = disc_EAD
+                data[f"{dike}_Expected Number of Deaths"][i] = END
+                data[f"{dike}_Dike Investment Costs"][i] = node[f"dikecosts {s}"]
 
-            data[f"RfR Total Costs"].append(G.nodes[f"RfR_projects {s}"]["cost"])
-            data[f"Expected Evacuation Costs"].append(np.sum(EECosts))
+            data["RfR Total Costs"][i] = G.nodes[f"RfR_projects {s}"]["cost"]
+            data["Expected Evacuation Costs"][i] = np.sum(EECosts)
 
+        if profile:
+            profile.lap("aggregation")
+            profile.maybe_dump(self.event_counts)
         return data
+
+    def _workspace_for(self, n_events):
+        """Workspace holding the state of at least n_events events, grown
+        (not reallocated) only when more events are simulated at once"""
+        if self._workspace is None or self._workspace.capacity < n_events:
+            self._workspace = SimulationWorkspace(n_events, len(self.network.dikes))
+        return self._workspace
+
+    def _simulate(self, wave_ids, critWL, wl_shift, Bmax, Brate, timestep, steps):
+        """Simulate all events of all planning steps for a block of
+        experiments.
+
+        Until the first dike breaches, the water levels follow from the
+        routed unit responses of the wave shape (see
+        funs_generate_network.route_unit_responses). Only events in which a
+        dike breaches are time-stepped, from the first breach onward.
+
+        Events whose peak water level is bounded below the critical water
+        level at every dike cannot breach and are not simulated at all.
+        The bound grows with Qpeak, so these are the lower events of the
+        Qpeak ladder; they are counted in self.event_counts["pruned"].
+        Results of the other events are kept in self.event_cache.
+
+        Parameters
+        ----------
+        wave_ids : ndarray
+                   upstream wave shape per experiment, (experiments,)
+        critWL : ndarray
+                 critical water level, (experiments, steps, dikes)
+        wl_shift : ndarray
+                   lowering of the rating curve, (experiments, dikes)
+        Bmax, Brate : ndarray
+                      breach parameters, (experiments, dikes)
+        steps : ndarray
+                boolean (experiments, steps), the planning steps to simulate
+
+        Returns
+        -------
+        wlmax, status : ndarray
+                        maximum water level and final breach status,
+                        (experiments, steps, events, dikes). wlmax is nan
+                        for events that were not simulated.
+        """
+        net = self.network
+        n_time = len(range(0, net.wave_shapes.shape[1], timestep))
+
+        waves = net.wave_shapes[wave_ids]
+        Q_0 = np.trunc(self.Qpeaks[None, :] * waves[:, None, 0])
+
+        # Upper bound of the pre-breach inflow at every dike over the event
+        # (after the start at t = 0), (experiments, events, dikes):
+        wave_peak = net.wave_response[wave_ids][..., 1:n_time].max(axis=-1)
+        initial_response = net.initial_response[:, 1:n_time]
+        initial_peak = np.where(
+            Q_0[..., None] >= 0,
+            initial_response.max(axis=-1),
+            initial_response.min(axis=-1),
+        )
+        Qbound = (
+            self.Qpeaks[None, :, None] * wave_peak[:, None]
+            + Q_0[..., None] * initial_peak
+        )
+
+        # and of the water level, from the running maximum of the rating curve:
+        wl_bound = np.empty(Qbound.shape)
+        for n, rating_table in enumerate(net.rating_tables):
+            wl_bound[..., n] = rating_table(Qbound[..., n], column=1)
+            wl_bound[..., n] -= wl_shift[:, None, n]
+
+        # Events that cannot breach in a step, (experiments, steps, events):
+        safe = (wl_bound[:, None] <= critWL[:, :, None, :]).all(axis=-1)
+        safe &= steps[..., None]
+        self.event_counts["pruned"] += np.count_nonzero(safe)
+
+        n_dikes = len(net.dikes)
+        wlmax = np.full(safe.shape + (n_dikes,), np.nan)
+        status = np.zeros(wlmax.shape, dtype=bool)
+        todo = ~safe & steps[..., None]
+
+        # Events simulated before, in this or an earlier call:
+        cache = self.event_cache
+        if cache.max_bytes > 0:
+            x, s, e = np.nonzero(todo)
+            keys = self._event_keys(
+                wave_ids[x],
+                self.Qpeaks[e],
+                critWL[x, s],
+                wl_shift[x],
+                Bmax[x],
+                Brate[x],
+                timestep,
+            )
+            found, values = cache.lookup(keys, 2 * n_dikes)
+            hit = x[found], s[found], e[found]
+            wlmax[hit] = values[:, :n_dikes]
+            status[hit] = values[:, n_dikes:] > 0
+            todo[hit] = False
+
+        self._simulate_events_array(
+            todo,
+            waves,
+            Q_0,
+            wave_ids,
+            critWL,
+            wl_shift,
+            Bmax,
+            Brate,
+            timestep,
+            wlmax,
+            status,
+        )
+
+        if cache.max_bytes > 0:
+            missed = x[~found], s[~found], e[~found]
+            cache.store(
+                keys[~found], np.concatenate([wlmax[missed], status[missed]], axis=1)
+            )
+        self.event_counts["breached"] += np.count_nonzero(status.any(axis=-1))
+        return wlmax, status
+
+    def _event_keys(self, wave_ids, Qpeaks, critWL, wl_shift, Bmax, Brate, timestep):
+        """Rows identifying events for the event cache: all inputs that the
+        water levels and breaches along the whole dike chain depend on, and
+        the settings of the time stepping"""
+        return np.column_stack(
+            [
+                np.full(len(wave_ids), timestep),
+                np.full(len(wave_ids), self.sb),
+                np.full(len(wave_ids), self.adaptive_tolerance or -1.0),
+                wave_ids,
+                Qpeaks,
+                critWL,
+                wl_shift,
+                Bmax,
+                Brate,
+            ]
+        ).astype(float)
+
+    def _simulate_events_array(
+        self,
+        todo,
+        waves,
+        Q_0,
+        wave_ids,
+        critWL,
+        wl_shift,
+        Bmax,
+        Brate,
+        timestep,
+        wlmax,
+        status,
+    ):
+        """Simulate the events where todo (experiments, steps, events) is
+        True, writing their maximum water level and breach status into
+        wlmax and status. See _simulate for the other arguments."""
+        net = self.network
+        n_time = len(range(0, net.wave_shapes.shape[1], timestep))
+
+        # Pre-breach inflow and water levels, (events, dikes, time) with the
+        # events of all steps flattened to (xi, ei):
+        xi, ei = np.nonzero(todo.any(axis=1))
+        if len(xi) == 0:
+            return
+        Qin = (
+            self.Qpeaks[ei, None, None] * net.wave_response[wave_ids[xi], :, :n_time]
+            + Q_0[xi, ei, None, None] * net.initial_response[None, :, :n_time]
+        )
+        wl = np.empty(Qin.shape)
+        for n, rating_table in enumerate(net.rating_tables):
+            wl[:, n] = rating_table(Qin[:, n], column=0)
+            wl[:, n] -= wl_shift[xi, n, None]
+        # the model starts every event at water level zero:
+        wl[..., 0] = 0
+        wl_cummax = np.maximum.accumulate(wl, axis=-1)
+
+        # First time step at which any dike fails, n_time if none does,
+        # (events, steps):
+        exceed = wl[:, None] > critWL[xi, :, :, None]
+        exceed[..., 0] = False
+        first = np.where(exceed.any(axis=-1), exceed.argmax(axis=-1), n_time)
+        t_breach = first.min(axis=-1)
+
+        r, s = np.nonzero(todo[xi, :, ei])
+        x, e = xi[r], ei[r]
+        wlmax[x, s, e] = wl_cummax[r, :, -1]
+        status[x, s, e] = first[r, s] < n_time
+
+        # Without the effect of breaches on the discharge downstream
+        # (sb == False), the routing is linear throughout the event:
+        breached = t_breach[r, s] < n_time
+        if not self.sb or not breached.any():
+            return
+
+        # Time-step the events with a breach, all starting from the earliest
+        # breach among them; before their own breach this matches the
+        # linear response:
+        r, x, s, e = r[breached], x[breached], s[breached], e[breached]
+        t_start = t_breach[r, s].min()
+        self.event_counts["time-stepped"] += len(r)
+
+        # For adaptive stepping, the highest pre-breach water level after
+        # every time step, taken as a bound on the rest of the event (see
+        # the adaptive_tolerance of the class):
+        wl_after = None
+        if self.adaptive_tolerance is not None:
+            wl_after = np.full((len(r),) + wl.shape[1:], -np.inf)
+            wl_after[..., :-1] = np.maximum.accumulate(wl[r, :, :0:-1], axis=-1)[
+                ..., ::-1
+            ]
+
+        ws = self._workspace_for(len(r))
+        ws_wlmax, ws_status = ws.reset(
+            Qin[r, :, t_start - 1], wl_cummax[r, :, t_start - 1]
+        )
+        step_events = (
+            self._step_events_compiled
+            if self.engine == "compiled"
+            else self._step_events
+        )
+        n_steps = step_events(
+            ws,
+            waves[x] * self.Qpeaks[e, None],
+            critWL[x, s],
+            wl_shift[x],
+            Bmax[x],
+            Brate[x],
+            t_start,
+            n_time,
+            timestep,
+            wl_after,
+        )
+        self.event_counts["time steps"] += n_steps
+        self.event_counts["time steps skipped"] += len(r) * (n_time - t_start) - n_steps
+        wlmax[x, s, e] = ws_wlmax
+        status[x, s, e] = ws_status
+
+    def _step_events(
+        self,
+        ws,
+        Qupstream,
+        critWL,
+        wl_shift,
+        Bmax,
+        Brate,
+        t_start,
+        n_time,
+        timestep,
+        wl_after=None,
+        first=0,
+        record=None,
+    ):
+        """Advance the events in the workspace, as arrays shaped (events,)
+        per dike, from time step t_start to the end of the discharge wave.
+
+        Qupstream is the discharge wave at the upstream boundary, (events,
+        time); critWL, wl_shift, Bmax and Brate are shaped (events, dikes).
+        With first > 0, only the dikes from first downstream are advanced
+        and Qupstream is the outflow of the dike upstream of first.
+        record, (events, dikes, time), receives the outflow of the advanced
+        dikes from time step t_start - 1 onward.
+
+        With wl_after, (events, dikes, time) the highest water level after
+        every time step without breaches, an event is no longer advanced
+        once that level stays below the critical water level of its intact
+        dikes and within self.adaptive_tolerance of the maximum water level
+        of its breached dikes. Returns the number of time steps of all
+        events.
+        """
+        net = self.network
+        k = len(Qupstream)
+        Qin, Qout, Qout_t0 = ws.Qin[:k], ws.Qout[:k], ws.Qout_t0[:k]
+        hbas, cumVol, wlmax = ws.hbas[:k], ws.cumVol[:k], ws.wlmax[:k]
+        status, tbreach = ws.status[:k], ws.tbreach[:k]
+
+        # workspace rows of the events that are still advanced:
+        rows = np.arange(k)
+        n_steps = 0
+        if record is not None:
+            record[:, first:, t_start - 1] = Qout[:, first:]
+
+        # Run over the discharge wave:
+        for t in range(t_start, n_time):
+            np.copyto(Qout_t0, Qout)
+            # Run over each node of the branch, in routing order:
+            for n in range(first, len(net.dikes)):
+                if n == first:
+                    prec_Qout_t1 = Qupstream[:, t]
+                    prec_Qout_t0 = Qupstream[:, t - 1]
+                else:
+                    prec_Qout_t1 = Qout[:, net.prec[n]]
+                    prec_Qout_t0 = Qout_t0[:, net.prec[n]]
+
+                Qin[:, n] = Muskingum(
+                    *net.muskingum[n], prec_Qout_t1, prec_Qout_t0, Qin[:, n]
+                )
+
+                # Transform Q in water levels:
+                wl = net.rating_tables[n](Qin[:, n], column=0)
+                wl -= wl_shift[:, n]
+                np.maximum(wlmax[:, n], wl, out=wlmax[:, n])
+
+                # As in _simulate_events, the flow balance sees the basin
+                # depth of time t before it is updated, i.e. zero:
+                res = dikefailure_vec(
+                    self.sb,
+                    Qin[:, n],
+                    wl,
+                    0,
+                    net.hground[n],
+                    status[:, n],
+                    Bmax[:, n],
+                    Brate[:, n],
+                    t * timestep,
+                    tbreach[:, n],
+                    critWL[:, n],
+                )
+                Qout[:, n], Qpol, status[:, n], tbreach[:, n] = res
+
+                # Volume inside the floodplain as the running integral of Q
+                # in time up to time t (trapezoidal, as in _simulate_events):
+                cumVol[:, n] += Qpol * self.timestepcorr
+                vol = cumVol[:, n]
+                if t == n_time - 1:
+                    vol = vol - 0.5 * Qpol * self.timestepcorr
+
+                Area = net.area_tables[n](wl)
+                hbas[:, n] = vol / Area
+
+            if record is not None:
+                record[:, first:, t] = Qout[:, first:]
+            n_steps += len(rows)
+            if wl_after is None:
+                continue
+
+            # Store the outcomes of the events that became quiet and
+            # continue with the others:
+            bound = wl_after[..., t]
+            quiet = np.where(
+                status, bound <= wlmax + self.adaptive_tolerance, bound <= critWL
+            ).all(axis=1)
+            if quiet.any():
+                ws.wlmax[rows[quiet]] = wlmax[quiet]
+                ws.status[rows[quiet]] = status[quiet]
+                keep = ~quiet
+                rows = rows[keep]
+                if len(rows) == 0:
+                    return n_steps
+                Qin, Qout, Qout_t0, hbas, cumVol, wlmax, status, tbreach = (
+                    a[keep]
+                    for a in (Qin, Qout, Qout_t0, hbas, cumVol, wlmax, status, tbreach)
+                )
+                Qupstream, critWL, wl_shift, Bmax, Brate, wl_after = (
+                    a[keep]
+                    for a in (Qupstream, critWL, wl_shift, Bmax, Brate, wl_after)
+                )
+
+        ws.wlmax[rows] = wlmax
+        ws.status[rows] = status
+        return n_steps
+
+    def _step_events_compiled(
+        self,
+        ws,
+        Qupstream,
+        critWL,
+        wl_shift,
+        Bmax,
+        Brate,
+        t_start,
+        n_time,
+        timestep,
+        wl_after=None,
+    ):
+        """Same as _step_events, using the compiled kernel"""
+        net = self.network
+        k = len(Qupstream)
+        adaptive = wl_after is not None
+        return funs_kernel.step_events(
+            np.ascontiguousarray(Qupstream, dtype=float),
+            np.ascontiguousarray(critWL, dtype=float),
+            np.ascontiguousarray(wl_shift, dtype=float),
+            np.ascontiguousarray(Bmax, dtype=float),
+            np.ascontiguousarray(Brate, dtype=float),
+            net.rc_q,
+            net.rc_wl,
+            net.rc_slope,
+            net.rc_len,
+            net.prec,
+            net.muskingum,
+            net.hground,
+            net.tables,
+            net.area_slope,
+            int(t_start),
+            int(n_time),
+            int(timestep),
+            bool(self.sb),
+            float(self.timestepcorr),
+            ws.Qin[:k],
+            ws.wlmax[:k],
+            ws.status[:k],
+            np.ascontiguousarray(wl_after) if adaptive else np.empty((0, 0, 0)),
+            float(self.adaptive_tolerance) if adaptive else 0.0,
+            adaptive,
+        )
+
+    def _event_outcomes(self, wlmax, status, evacuation_percentage, days_to_threat):
+        """Losses, deaths and evacuation costs per event, zero where no
+        breach occured. evacuation_percentage and days_to_threat broadcast
+        against wlmax and status of a single dike, i.e. without the last
+        (dikes) axis"""
+        losses, deaths, evacuation_costs = (np.zeros(wlmax.shape) for _ in range(3))
+        for n, outcome_table in enumerate(self.network.outcome_tables):
+            breached = status[..., n]
+            loss, death, evacuees = np.moveaxis(outcome_table(wlmax[..., n]), -1, 0)
+
+            losses[..., n] = np.where(breached, loss, 0)
+            deaths[..., n] = np.where(breached, death * (1 - evacuation_percentage), 0)
+            evacuation_costs[..., n] = np.where(
+                breached,
+                cost_evacuation(evacuees * evacuation_percentage, days_to_threat),
+                0,
+            )
+        return losses, deaths, evacuation_costs
+
+    def __call__(self, timestep=1, **kwargs):
+        """Run the model for one experiment. Keyword arguments are the
+        uncertainties and levers, e.g. 'A.1_Bmax' or '0_RfR 1'. Returns the
+        outcomes as a mapping of their names to values per planning step
+        (see funs_outcomes.Outcomes)."""
+        if self.engine == "scalar":
+            return self._call_graph(timestep, **kwargs)
+
+        experiments = {key: np.array([value]) for key, value in kwargs.items()}
+        outcomes = Outcomes.empty(self.dikelist, len(self.planning_steps), 1)
+        self._evaluate_block(experiments, timestep, outcomes.values)
+        return outcomes.take(0)
+
+    def evaluate_batch(self, uncertainties, levers=None, timestep=1, block_size=1000):
+        """Evaluate a block of experiments in one vectorized pass, with an
+        experiment axis in front of the steps, events and dikes axes.
+
+        Parameters
+        ----------
+        uncertainties : DataFrame or dict
+                        one row per experiment, columns named like the
+                        keyword arguments of __call__ (e.g. 'A.1_Bmax')
+        levers : DataFrame or dict, optional
+                 one row per experiment, or a single row (one policy, which
+                 may also be a mapping of scalars like a workbench Policy)
+                 that is applied to every experiment. Can also be left out
+                 when the levers are columns of uncertainties.
+        block_size : int
+                     maximum number of experiments simulated at once, to
+                     bound memory use
+
+        Returns
+        -------
+        Outcomes
+            same keys as the outcomes of __call__, each an array shaped
+            (experiments, planning steps), as views on one array shaped
+            (experiments, outcomes, planning steps)
+        """
+        experiments = _stack_experiments(uncertainties, levers)
+        n_experiments = len(next(iter(experiments.values())))
+
+        outcomes = Outcomes.empty(
+            self.dikelist, len(self.planning_steps), n_experiments
+        )
+        for i in range(0, n_experiments, block_size):
+            block = {
+                key: values[i : i + block_size] for key, values in experiments.items()
+            }
+            self._evaluate_block(block, timestep, outcomes.values[i : i + block_size])
+        return outcomes
+
+    def evaluate_chain(self, timestep=1, **kwargs):
+        """Run the model for one experiment, like __call__, keeping the
+        hydrographs of every dike for evaluate_incremental.
+
+        All events are time-stepped along the whole chain, with the numpy
+        stepper of the vectorized engine and without adaptive stepping,
+        whatever the engine of the model. Returns a ChainState; its outcomes
+        are those of __call__.
+        """
+        return self._evaluate_chain(kwargs, timestep)
+
+    def evaluate_incremental(self, base, **changes):
+        """Re-evaluate the ChainState base of evaluate_chain with some of
+        its uncertainties and levers changed.
+
+        Per planning step, the dikes upstream of the first dike whose
+        inputs changed (critical water level, rating curve lowering or
+        breach parameters) see the same inflow as in base, so their
+        hydrographs, water levels and breaches are reused and only the
+        dikes from there downstream are simulated again. A different wave
+        shape changes every dike. Changes that only enter the outcomes,
+        such as the early warning system or the discount rates, simulate
+        nothing at all. Returns the ChainState of the changed experiment.
+        """
+        if not np.array_equal(base.Qpeaks, self.Qpeaks):
+            raise ValueError("base was evaluated with another event set")
+        parameters = dict(base.parameters)
+        parameters.update(changes)
+        return self._evaluate_chain(parameters, base.timestep, base)
+
+    def _evaluate_chain(self, parameters, timestep, base=None):
+        """ChainState of one experiment, reusing the upstream dikes of base"""
+        profile = self._profiled()
+        if profile:
+            profile.start()
+        experiments = {key: np.array([value]) for key, value in parameters.items()}
+        bound = self._bind(experiments, profile)
+
+        net = self.network
+        n_steps, n_events = len(self.planning_steps), len(self.Qpeaks)
+        n_dikes = len(net.dikes)
+        n_time = len(range(0, net.wave_shapes.shape[1], timestep))
+
+        wave = net.wave_shapes[bound.wave_ids[0]]
+        Qupstream = self.Qpeaks[:, None] * wave
+        Q_0 = np.trunc(self.Qpeaks * wave[0])
+
+        # First dike to simulate per step, n_dikes if none:
+        first = np.zeros(n_steps, dtype=int)
+        if base is not None:
+            changed = bound.critWL[0] != base.bound.critWL[0]
+            for key in ("wl_shift", "Bmax", "Brate"):
+                changed |= getattr(bound, key)[0] != getattr(base.bound, key)[0]
+            if bound.wave_ids[0] != base.bound.wave_ids[0]:
+                changed[:] = True
+            first = np.where(changed.any(axis=1), changed.argmax(axis=1), n_dikes)
+
+        Qout = np.empty((n_steps, n_events, n_dikes, n_time))
+        wlmax = np.empty((n_steps, n_events, n_dikes))
+        status = np.empty(wlmax.shape, dtype=bool)
+        for s, f in enumerate(first):
+            if f > 0:
+                Qout[s, :, :f] = base.Qout[s, :, :f]
+                wlmax[s, :, :f] = base.wlmax[s, :, :f]
+                status[s, :, :f] = base.status[s, :, :f]
+                self.event_counts["dikes reused"] += f
+            if f == n_dikes:
+                continue
+
+            # every event starts from Qin = Qout = Q_0 at all dikes:
+            ws = self._workspace_for(n_events)
+            ws_wlmax, ws_status = ws.reset(np.repeat(Q_0[:, None], n_dikes, axis=1), 0)
+            rows = np.zeros(n_events, dtype=int)
+            time_steps = self._step_events(
+                ws,
+                Qupstream if f == 0 else base.Qout[s, :, f - 1],
+                bound.critWL[rows, s],
+                bound.wl_shift[rows],
+                bound.Bmax[rows],
+                bound.Brate[rows],
+                1,
+                n_time,
+                timestep,
+                first=f,
+                record=Qout[s],
+            )
+            wlmax[s, :, f:] = ws_wlmax[:, f:]
+            status[s, :, f:] = ws_status[:, f:]
+            self.event_counts["events"] += n_events
+            self.event_counts["time-stepped"] += n_events
+            self.event_counts["time steps"] += time_steps
+        self.event_counts["breached"] += np.count_nonzero(status.any(axis=-1))
+        if profile:
+            profile.lap("routing")
+
+        outcomes = Outcomes.empty(self.dikelist, n_steps, 1)
+        same_as = np.arange(n_steps)[None]
+        self._aggregate(
+            bound, wlmax[None], status[None], same_as, outcomes.values, profile
+        )
+        if profile:
+            profile.maybe_dump(self.event_counts)
+        return ChainState(
+            parameters,
+            timestep,
+            self.Qpeaks,
+            bound,
+            Qout,
+            wlmax,
+            status,
+            outcomes.take(0),
+        )
+
+    def _evaluate_block(self, experiments, timestep, out):
+        """Vectorized evaluation of a dict of equally long parameter arrays,
+        writing the outcomes into out, (experiments, outcomes, steps) in the
+        order of self.outcome_names"""
+        profile = self._profiled()
+        if profile:
+            profile.start()
+        bound = self._bind(experiments, profile)
+        critWL = bound.critWL
+
+        # Steps with the same critical water levels as an earlier step
+        # (rating curves and evacuation do not change between steps) have
+        # the same events, (experiments, steps):
+        equal = (critWL[:, :, None, :] == critWL[:, None, :, :]).all(axis=-1)
+        same_as = equal.argmax(axis=-1)
+        steps_new = same_as == np.arange(len(self.planning_steps))
+        self.event_counts["events"] += same_as.size * len(self.Qpeaks)
+        self.event_counts["repeated"] += np.count_nonzero(~steps_new) * len(self.Qpeaks)
+
+        # Simulate all events of the new steps:
+        wlmax, status = self._simulate(
+            bound.wave_ids,
+            critWL,
+            bound.wl_shift,
+            bound.Bmax,
+            bound.Brate,
+            timestep,
+            steps_new,
+        )
+        if profile:
+            profile.lap("routing")
+
+        self._aggregate(bound, wlmax, status, same_as, out, profile)
+        if profile:
+            profile.maybe_dump(self.event_counts)
+
+    def _bind(self, experiments, profile=None):
+        """BoundExperiments of a dict of equally long parameter arrays"""
+        net = self.network
+        dikes = net.dikes
+        steps = self.planning_steps
+        n_exp = len(next(iter(experiments.values())))
+
+        unknown = set(experiments) - self._parameter_names
+        if unknown:
+            raise KeyError(f"unknown model parameters {sorted(unknown)}")
+
+        def column(name, default=None):
+            if name not in experiments and default is not None:
+                return np.full(n_exp, default)
+            return np.asarray(experiments[name])
+
+        def dike_columns(key):
+            return np.column_stack([column(f"{dike}_{key}") for dike in dikes]).astype(
+                float
+            )
+
+        def lever_columns(key, names, default=None):
+            values = np.column_stack(
+                [column(f"{name}_{key}", default) for name in names]
+            )
+            if not np.array_equal(values, np.round(values)):
+                raise ValueError(f"{key} levers must be integers")
+            return values.astype(int)
+
+        # Uncertainties, (experiments, dikes) and (experiments, steps):
+        Bmax = dike_columns("Bmax")
+        Brate = dike_columns("Brate")
+        pfail = dike_columns("pfail")
+        rates = np.column_stack([column(f"discount rate {s}") for s in steps])
+        wave_ids = column("A.0_ID flood wave shape").astype(int)
+
+        # Dike heightening, (experiments, steps, dikes) in steps of dh:
+        tables = self.policy_tables
+        increase = np.stack(
+            [lever_columns(f"DikeIncrease {s}", dikes) for s in steps], axis=1
+        )
+        if increase.min(initial=0) < 0 or increase.max(initial=0) > tables.max_increase:
+            raise ValueError(
+                f"DikeIncrease must be between 0 and {tables.max_increase}"
+            )
+        if profile:
+            profile.lap("binding")
+
+        cumulative = np.cumsum(increase, axis=1)
+
+        critWL = np.empty(increase.shape)
+        dikecosts = np.empty(increase.shape)
+        for n in range(len(dikes)):
+            # Shifting the fragility curve shifts the critical water level:
+            critWL[..., n] = (
+                net.fragility_tables[n](pfail[:, n])[:, None]
+                + tables.heights[cumulative[..., n]]
+            )
+            dikecosts[..., n] = tables.dike_costs[
+                n, cumulative[..., n], increase[..., n]
+            ]
+        if profile:
+            profile.lap("heights and costs")
+
+        # Room for the river: costs per step and lowering of rating curves,
+        # with the projects on the last axis, (experiments, steps, projects)
+        rfr = np.stack(
+            [lever_columns(f"RfR {s}", net.rfr_projects, 0) for s in steps],
+            axis=1,
+        )
+        if rfr.min(initial=0) < 0 or rfr.max(initial=0) > 1:
+            raise ValueError("RfR must be 0 or 1")
+        rfr_costs = tables.rfr_costs[tuple(np.moveaxis(rfr, -1, 0))]
+        wl_shift = tables.rfr_lowering[tuple(rfr.sum(axis=1).T)]
+
+        # Early warning system:
+        days_to_threat = column("EWS_DaysToThreat").astype(int)
+        evacuation_percentage = net.evacuees[days_to_threat]
+        if profile:
+            profile.lap("rfr init")
+
+        return BoundExperiments(
+            wave_ids,
+            Bmax,
+            Brate,
+            critWL,
+            wl_shift,
+            dikecosts,
+            rfr_costs,
+            rates,
+            days_to_threat,
+            evacuation_percentage,
+        )
+
+    def _aggregate(self, bound, wlmax, status, same_as, out, profile=None):
+        """Integrate the outcomes of the events over them and write them
+        into out. wlmax and status are those of _simulate; same_as is the
+        index of the step whose events every step repeats, (experiments,
+        steps)."""
+        dikes = self.network.dikes
+        n_exp = len(same_as)
+        steps_new = same_as == np.arange(same_as.shape[1])
+
+        x, s = np.nonzero(steps_new)
+        losses, deaths, evacuation_costs = self._event_outcomes(
+            wlmax[x, s],
+            status[x, s],
+            bound.evacuation_percentage[x, None],
+            bound.days_to_threat[x, None],
+        )
+        if profile:
+            profile.lap("breach evaluation")
+
+        # Integrate over the events (axis 1) and copy to the repeated steps:
+        row = np.full(same_as.shape, -1)
+        row[x, s] = np.arange(len(x))
+        row = row[np.arange(n_exp)[:, None], same_as]
+        weights = self.event_weights[:, None]
+        EAD = np.sum(losses * weights, axis=1)[row]
+        END = np.sum(deaths * weights, axis=1)[row]
+        EECosts = np.sum(evacuation_costs * weights, axis=1).sum(axis=-1)[row]
+
+        # Discount per step:
+        rates = bound.rates
+        unique, inverse = np.unique(rates, return_inverse=True)
+        disc_factor = np.array([annuity_factor(r, self.y_step) for r in unique])
+        EAD *= disc_factor[inverse].reshape(rates.shape)[..., None]
+
+        # Outcomes, with the steps on the last axis:
+        outcomes = Outcomes(dikes, out)
+        per_dike = outcomes.per_dike
+        for m, values in enumerate((EAD, END, bound.dikecosts)):
+            per_dike[..., m, :] = values.transpose(0, 2, 1)
+        outcomes.network[..., 0, :] = bound.rfr_costs
+        outcomes.network[..., 1, :] = EECosts
+        if profile:
+            profile.lap("aggregation")
+
+
+class VectorFunction:
+    """Flat vector interface to a DikeNetwork, for optimizers that evaluate
+    one parameter vector at a time.
+
+    The names of the parameters and the variables that make up every
+    outcome are checked and turned into positions once, when the function
+    is built; a call then only binds the columns of the vector and sums the
+    outcome variables with one matrix product.
+
+    Parameters
+    ----------
+    model : DikeNetwork
+    parameters : sequence of str
+                 model parameters (e.g. 'A.1_Bmax') in vector order
+    outcomes : sequence of (str, sequence of str), optional
+               name of every outcome and the model outcomes it sums over
+               all planning steps, in vector order; by default every model
+               outcome per planning step, named '<outcome> <step>'
+    fixed : dict, optional
+            values of the model parameters that are not in the vector, e.g.
+            a reference scenario when searching over the levers
+    timestep : int
+    """
+
+    def __init__(self, model, parameters, outcomes=None, fixed=None, timestep=1):
+        self.model = model
+        self.parameters = list(parameters)
+        self.fixed = dict(fixed or {})
+        self.timestep = timestep
+
+        names = self.parameters + list(self.fixed)
+        unknown = set(names) - model._parameter_names
+        if unknown:
+            raise KeyError(f"unknown model parameters {sorted(unknown)}")
+        if len(set(names)) != len(names):
+            raise ValueError("parameters must be unique and not also fixed")
+
+        # Outcome vector as a linear map of the (variables, steps) outcomes
+        # of the model:
+        variables = model.outcome_names
+        steps = list(model.planning_steps)
+        self._shape = (len(variables), len(steps))
+        if outcomes is None:
+            self.outcome_names = [f"{name} {s}" for name in variables for s in steps]
+            self._matrix = np.eye(len(self.outcome_names))
+            return
+
+        self.outcome_names = [name for name, _ in outcomes]
+        self._matrix = np.zeros((len(outcomes), len(variables), len(steps)))
+        for i, (name, sums) in enumerate(outcomes):
+            missing = set(sums) - set(variables)
+            if missing:
+                raise KeyError(f"unknown model outcomes {sorted(missing)}")
+            for variable in sums:
+                self._matrix[i, variables.index(variable)] = 1
+        self._matrix = self._matrix.reshape(len(outcomes), -1)
+
+    def __call__(self, x):
+        """Outcome vector of the parameter vector x, or an (experiments,
+        outcomes) array for an (experiments, parameters) array x"""
+        x = np.asarray(x, dtype=float)
+        X = np.atleast_2d(x)
+        if X.ndim != 2 or X.shape[1] != len(self.parameters):
+            raise ValueError(
+                f"expected {len(self.parameters)} parameters, got shape {x.shape}"
+            )
+
+        experiments = dict(zip(self.parameters, X.T))
+        for name, value in self.fixed.items():
+            experiments[name] = np.full(len(X), value)
+
+        if self.model.engine == "scalar":
+            values = np.stack(
+                [
+                    self.model(**{k: v[i] for k, v in experiments.items()}).values
+                    for i in range(len(X))
+                ]
+            )
+        else:
+            values = np.empty((len(X),) + self._shape)
+            self.model._evaluate_block(experiments, self.timestep, values)
+
+        y = values.reshape(len(X), -1) @ self._matrix.T
+        return y[0] if x.ndim == 1 else y
+
+
+class SimulationWorkspace:
+    """Preallocated state arrays of the array engines, shaped (events,
+    dikes) for up to capacity events. They are reset, not reallocated,
+    between runs."""
+
+    def __init__(self, capacity, n_dikes):
+        self.capacity = capacity
+        shape = (capacity, n_dikes)
+        self.Qin, self.Qout, self.Qout_t0 = (np.empty(shape) for _ in range(3))
+        self.hbas, self.cumVol, self.wlmax = (np.empty(shape) for _ in range(3))
+        self.tbreach = np.empty(shape)
+        self.status = np.empty(shape, dtype=bool)
+
+    def reset(self, Qin, wlmax):
+        """Start len(Qin) events from the (events, dikes) shaped discharge
+        Qin (equal to the outflow, no dike has failed yet) and maximum water
+        level wlmax. Returns views on the wlmax and status of these events."""
+        k = len(Qin)
+        self.Qin[:k] = Qin
+        self.Qout[:k] = Qin
+        self.wlmax[:k] = wlmax
+        self.hbas[:k] = 0
+        self.cumVol[:k] = 0
+        self.tbreach[:k] = np.nan
+        self.status[:k] = False
+        return self.wlmax[:k], self.status[:k]
+
+
+def _table(data):
+    """DataFrame of a table of experiments, or of a single one given as a
+    mapping of scalars (e.g. a workbench Scenario or Policy)"""
+    if isinstance(data, Mapping) and all(np.ndim(v) == 0 for v in data.values()):
+        return pd.DataFrame([dict(data)])
+    return pd.DataFrame(data).reset_index(drop=True)
+
+
+def _stack_experiments(uncertainties, levers=None):
+    """Combine uncertainty and lever tables into a dict of equally long
+    parameter arrays, repeating a single row of either to the length of the
+    other"""
+    uncertainties = _table(uncertainties)
+    if levers is not None:
+        levers = _table(levers)
+        if len(levers) == 1 and len(uncertainties) > 1:
+            levers = levers.loc[[0] * len(uncertainties)].reset_index(drop=True)
+        elif len(uncertainties) == 1 and len(levers) > 1:
+            uncertainties = uncertainties.loc[[0] * len(levers)].reset_index(drop=True)
+        elif len(uncertainties) != len(levers):
+            raise ValueError(
+                f"cannot combine {len(uncertainties)} scenarios with "
+                f"{len(levers)} policies"
+            )
+        uncertainties = pd.concat([uncertainties, levers], axis=1)
+    return {key: values.to_numpy() for key, values in uncertainties.items()}
+
+
+def sample_experiments(model, n_experiments, seed=None):
+    """Random experiments for model (a DikeNetwork), one row per experiment
+    with a column per uncertainty and lever, drawn from the ranges of
+    problem_formulation"""
+    rng = np.random.default_rng(seed)
+    columns = {
+        "A.0_ID flood wave shape": rng.integers(0, 133, n_experiments),
+        "EWS_DaysToThreat": rng.integers(0, 5, n_experiments),
+    }
+    for dike in model.dikelist:
+        columns[f"{dike}_Bmax"] = rng.uniform(30, 350, n_experiments)
+        columns[f"{dike}_pfail"] = rng.uniform(0, 1, n_experiments)
+        columns[f"{dike}_Brate"] = rng.choice([1.0, 1.5, 10], n_experiments)
+    for s in model.planning_steps:
+        columns[f"discount rate {s}"] = rng.choice([1.5, 2.5, 3.5, 4.5], n_experiments)
+        for dike in model.dikelist:
+            columns[f"{dike}_DikeIncrease {s}"] = rng.integers(0, 11, n_experiments)
+        for project in model.network.rfr_projects:
+            columns[f"{project}_RfR {s}"] = rng.integers(0, 2, n_experiments)
+    return pd.DataFrame(columns)
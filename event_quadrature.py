@@ -0,0 +1,83 @@
+"""
+Accuracy of the flood event sets of the dike model.
+
+Evaluates random experiments with every event set method of
+funs_hydrostat.event_set for a range of event counts, and reports the
+relative error of the expected annual damage and number of deaths (summed
+over dikes and planning steps) against a dense set of reference events.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from dike_model_function import DikeNetwork, sample_experiments
+from funs_hydrostat import EVENT_SETS
+
+
+def expected_totals(model, experiments):
+    """Expected annual damage and number of deaths per experiment"""
+    # bound the memory of the (experiments, events, ...) arrays:
+    block_size = max(1, 20000 // len(model.Qpeaks))
+    outcomes = model.evaluate_batch(experiments, block_size=block_size)
+    EAD = sum(v for k, v in outcomes.items() if k.endswith("Expected Annual Damage"))
+    END = sum(v for k, v in outcomes.items() if k.endswith("Expected Number of Deaths"))
+    return EAD.sum(axis=1), END.sum(axis=1)
+
+
+def quadrature_errors(
+    model, experiments, counts, reference_events=2000, random_seeds=5
+):
+    """Mean absolute error of the expected annual damage and number of
+    deaths over the experiments, relative to their mean, per event set
+    method and number of events. The error of the 'random' method is
+    averaged over random_seeds event sets."""
+    model.set_events("stratified", reference_events)
+    reference = expected_totals(model, experiments)
+
+    rows = []
+    for method in EVENT_SETS:
+        for n_events in counts:
+            errors = []
+            for seed in range(random_seeds if method == "random" else 1):
+                model.set_events(method, n_events, seed)
+                totals = expected_totals(model, experiments)
+                errors.append(
+                    [
+                        np.abs(total - ref).mean() / ref.mean()
+                        for total, ref in zip(totals, reference)
+                    ]
+                )
+            EAD_error, END_error = np.mean(errors, axis=0)
+            rows.append(
+                {
+                    "method": method,
+                    "events": len(model.Qpeaks),
+                    "EAD error": EAD_error,
+                    "END error": END_error,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="event_quadrature",
+        description="Reports the integration error of the flood event sets",
+    )
+    parser.add_argument("-N", "--num_experiments", type=int, default=200)
+    parser.add_argument(
+        "--counts", type=int, nargs="+", default=[4, 6, 8, 10, 12, 16, 20, 30]
+    )
+    parser.add_argument("--reference_events", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1361)
+    parser.add_argument("--output", help="also write the table to this csv file")
+    args = parser.parse_args()
+
+    model = DikeNetwork(cache_size=0)
+    experiments = sample_experiments(model, args.num_experiments, args.seed)
+    errors = quadrature_errors(model, experiments, args.counts, args.reference_events)
+
+    print(errors.to_string(index=False))
+    if args.output:
+        errors.to_csv(args.output, index=False)
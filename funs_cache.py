@@ -0,0 +1,95 @@
+"""
+Memory-bounded least-recently-used cache of per-event simulation results.
+
+DikeNetwork keys every event it simulates by the hydraulic inputs of the
+whole dike chain (see DikeNetwork._event_keys) and keeps the maximum water
+level and breach status per dike. Experiments that share those inputs, e.g.
+policies evaluated against the same scenarios or planning steps without a
+change in dike heights, then reuse the result instead of simulating the
+event again.
+"""
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+# Memory taken by an entry besides the bytes of its key and value (the
+# dictionary slot, list links and the bytes objects themselves):
+_ENTRY_OVERHEAD = 150
+
+
+def _rows_as_bytes(array):
+    """List with the raw bytes of every row of a 2d array"""
+    array = np.ascontiguousarray(array)
+    row = np.dtype((np.void, array.dtype.itemsize * array.shape[1]))
+    return array.view(row).ravel().tolist()
+
+
+class EventCache:
+    """Least-recently-used mapping of event keys to result rows, holding at
+    most max_bytes of keys and values.
+
+    Keys and values are rows of 2d float arrays, so that whole blocks of
+    events are looked up and stored at once. counts holds the number of
+    hits, misses and evictions since the cache was created or cleared.
+    Pickled copies (e.g. the ones sent to worker processes) start empty.
+
+    Parameters
+    ----------
+    max_bytes : int
+                memory bound of the cache, 0 disables it
+    """
+
+    def __init__(self, max_bytes=32 * 2**20):
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.counts = Counter(hits=0, misses=0, evictions=0)
+
+    def lookup(self, keys, n_values):
+        """Look up the rows of keys, a 2d float array.
+
+        Returns a boolean mask of the keys found and their values, shaped
+        (found, n_values)."""
+        found = np.zeros(len(keys), dtype=bool)
+        values = []
+        if self.max_bytes > 0:
+            entries = self._entries
+            for i, key in enumerate(_rows_as_bytes(keys)):
+                value = entries.get(key)
+                if value is not None:
+                    entries.move_to_end(key)
+                    found[i] = True
+                    values.append(value)
+
+        self.counts["hits"] += len(values)
+        self.counts["misses"] += len(keys) - len(values)
+        values = np.frombuffer(b"".join(values), dtype=float)
+        return found, values.reshape(-1, n_values)
+
+    def store(self, keys, values):
+        """Store the rows of values under the rows of keys, evicting the
+        least recently used entries beyond max_bytes"""
+        if self.max_bytes <= 0:
+            return
+        entries = self._entries
+        for key, value in zip(_rows_as_bytes(keys), _rows_as_bytes(values)):
+            if key in entries:
+                continue
+            entries[key] = value
+            self.nbytes += len(key) + len(value) + _ENTRY_OVERHEAD
+            while self.nbytes > self.max_bytes:
+                old_key, old_value = entries.popitem(last=False)
+                self.nbytes -= len(old_key) + len(old_value) + _ENTRY_OVERHEAD
+                self.counts["evictions"] += 1
@@ -0,0 +1,118 @@
+"""
+Append-only checkpoints of long experiment runs.
+
+A CheckpointStore is a directory holding the results of an experiment run
+in chunks, as they complete, and a manifest that lists the experiments of
+every chunk written so far. A chunk only appears in the manifest once its
+file is complete, so a run that is killed at any point loses at most the
+chunk in progress. The design of the run (scenarios, policies, seed, model
+version) is kept in the manifest too, so that a resumed run can check it
+plans the same experiments of the same model. merge then joins the chunks
+into the results tuple of ema_workbench's perform_experiments, e.g. for
+save_results, after which remove deletes the directory.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = "manifest.jsonl"
+
+
+def design_digest(scenarios, policies):
+    """Hash of the names and values of the scenarios and policies of a run"""
+    digest = hashlib.sha256()
+    for point in list(scenarios) + list(policies):
+        items = sorted((str(k), repr(v)) for k, v in point.items())
+        digest.update(repr((point.name, items)).encode())
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """Chunks of results in directory, with a manifest of their experiments.
+
+    Parameters
+    ----------
+    directory : str
+    design : dict
+             description of the run, e.g. its mode, seed, design_digest and
+             model version;
+             the store refuses a directory that holds chunks of a
+             different design
+    """
+
+    def __init__(self, directory, design):
+        self.directory = directory
+        self.design = design
+        self.chunks = []
+
+        path = os.path.join(directory, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if lines[0]["design"] != design:
+                raise ValueError(
+                    f"{directory} holds the results of another experiment "
+                    f"design: {lines[0]['design']}"
+                )
+            self.chunks = lines[1:]
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self._append_line({"design": design})
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _append_line(self, entry):
+        with open(os.path.join(self.directory, MANIFEST), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def completed(self):
+        """Set of the (scenario, policy) names of the stored experiments"""
+        return {
+            tuple(experiment)
+            for chunk in self.chunks
+            for experiment in chunk["experiments"]
+        }
+
+    def append(self, results):
+        """Store the (experiments, outcomes) results of perform_experiments
+        as the next chunk"""
+        experiments, outcomes = results
+        name = f"chunk_{len(self.chunks):05d}.pkl"
+        path = os.path.join(self.directory, name)
+
+        # write and rename, so that a chunk file is either whole or absent:
+        pd.to_pickle((experiments, outcomes), path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+        ids = zip(experiments["scenario"].tolist(), experiments["policy"].tolist())
+        entry = {"chunk": name, "experiments": [list(pair) for pair in ids]}
+        self._append_line(entry)
+        self.chunks.append(entry)
+
+    def merge(self):
+        """Results of all chunks, in the order they were stored, as one
+        (experiments, outcomes) tuple"""
+        if not self.chunks:
+            raise ValueError(f"no results stored in {self.directory}")
+        parts = [
+            pd.read_pickle(os.path.join(self.directory, chunk["chunk"]))
+            for chunk in self.chunks
+        ]
+        experiments = pd.concat([p[0] for p in parts], ignore_index=True)
+        outcomes = {
+            key: np.concatenate([p[1][key] for p in parts]) for key in parts[0][1]
+        }
+        return experiments, outcomes
+
+    def remove(self):
+        """Delete the directory with its chunks and manifest, once their
+        merged results are saved"""
+        shutil.rmtree(self.directory)
+        self.chunks = []
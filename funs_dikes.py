@@ -58,6 +58,43 @@ def dikefailure(
     return outflow, breachflow, status_t2, tbr
 
 
+def dikefailure_vec(
+    sb, inflow, hriver, hbas, hground, status_t1, Bmax, Brate, simtime, tbreach, critWL
+):
+    """Array version of dikefailure: evaluates the failure and flow balance
+    for many events at once, element-wise over equally shaped arrays
+
+     status_t1 = boolean array, True where the dike has already failed
+     tbreach = time of breach, nan where the dike has not failed yet
+
+    """
+    status_t1 = np.asarray(status_t1, dtype=bool)
+
+    # h river is a water level, hbas a water depth
+    h1 = hriver - (hground + hbas)
+
+    # breach width and flow only matter where the dike has already failed,
+    # elsewhere tbreach is nan:
+    with np.errstate(invalid="ignore"):
+        B = Bmax * (1 - np.exp(-Brate * (simtime - tbreach)))
+        breachflow = np.where(
+            status_t1 & (h1 > 0), 1.7 * B * np.maximum(h1, 0) ** 1.5, 0.0
+        )
+
+    outflow = np.where(status_t1, np.maximum(0, inflow - breachflow), inflow)
+
+    # failure can only occur where the dike has not failed yet:
+    failure = ~status_t1 & (hriver > critWL)
+    status_t2 = status_t1 | failure
+    tbr = np.where(failure, simtime, tbreach)
+
+    # if effects of hydrodynamic system behaviour have to be ignored:
+    if sb == False:
+        outflow = np.array(inflow, dtype=float)
+
+    return outflow, breachflow, status_t2, tbr
+
+
 def Lookuplin(MyFile, inputcol, searchcol, inputvalue):
     """Linear lookup function"""
     return np.interp(inputvalue, MyFile[:, inputcol], MyFile[:, searchcol])
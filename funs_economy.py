@@ -3,6 +3,8 @@ Created on Sun Oct 29 15:52:12 2017
 
 @author: ciullo
 """
+from functools import lru_cache
+
 import numpy as np
 
 
@@ -20,11 +22,22 @@ def discount(amount, rate, n):
     """discount function overall a planning period of n years"""
 
     factor = 1 + rate / 100
-    disc_amount = amount * 1 / (np.repeat(factor, n) ** (range(1, n + 1)))
+    disc_amount = amount / factor ** np.arange(1, n + 1)
     return disc_amount
 
 
+@lru_cache(maxsize=None)
+def annuity_factor(rate, n):
+    """Sum of the discount factors over a planning period of n years, i.e.
+    np.sum(discount(1, rate, n)), in closed form"""
+    if rate == 0:
+        return float(n)
+    r = rate / 100
+    return (1 - (1 + r) ** -n) / r
+
+
 def cost_evacuation(N_evacuated, days_to_threat):
     # if days to threat is zero, then no evacuation happens, costs are zero
-    cost = N_evacuated * 22 * (days_to_threat + 3) * (int(days_to_threat > 0))
+    # (days_to_threat can be a scalar or an array of experiments)
+    cost = N_evacuated * 22 * (days_to_threat + 3) * (np.asarray(days_to_threat) > 0)
     return cost
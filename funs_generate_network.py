@@ -1,19 +1,106 @@
+import glob
+import hashlib
+import os
 import numpy as np
 import networkx as nx
 import pandas as pd
+from collections import namedtuple
 from funs_dikes import Lookuplin  # @UnresolvedImport
+from funs_economy import cost_fun
+import funs_interp
+
+# Binary cache of all data files read by get_network and DikeNetwork:
+CACHE_FILE = "./data/cache/network_sources.pkl"
+
+# How each data file is read, by table name:
+_READERS = {
+    "dikes": lambda path: pd.read_excel(path, dtype=object),
+    "frag_curves": lambda path: pd.read_excel(path, header=None, index_col=0),
+    "calibration_factors": lambda path: pd.read_excel(path, index_col=0),
+    "rfr_strategies": lambda path: pd.read_excel(
+        path, index_col=0, names=["project name", 0, 1, 2, 3, 4]
+    ),
+    "EWS": lambda path: pd.read_excel(path),
+    "muskingum": lambda path: pd.read_excel(path, index_col=0),
+    "wave_shapes": lambda path: pd.read_excel(path, index_col=0),
+    "werklijn_params": lambda path: pd.read_excel(path),
+    "losses": lambda path: pd.read_excel(path, index_col=0),
+    "rating_curve": np.loadtxt,
+}
 
 
 def to_dict_dropna(data):
     return {str(k): v.dropna().to_dict() for k, v in data.items()}
 
 
-def get_network(plann_steps_max=10):
+def _source_files():
+    """Data files of the network, by table name"""
+    files = {
+        "dikes": "./data/dikeIjssel.xlsx",
+        "frag_curves": "./data/fragcurves/frag_curves.xlsx",
+        "calibration_factors": "./data/fragcurves/calfactors_pf1250.xlsx",
+        "rfr_strategies": "./data/rfr_strategies.xlsx",
+        "EWS": "./data/EWS.xlsx",
+        "muskingum": "./data/muskingum/params.xlsx",
+        "wave_shapes": "./data/hydrology/wave_shapes.xls",
+        "werklijn_params": "./data/hydrology/werklijn_params.xlsx",
+    }
+    for path in sorted(glob.glob("./data/losses_tables/*_lossestable.xlsx")):
+        dike = os.path.basename(path).split("_")[0]
+        files[f"losses {dike}"] = path
+    for path in sorted(glob.glob("./data/rating_curves/*_ratingcurve_new.txt")):
+        dike = os.path.basename(path).split("_")[0]
+        files[f"rating_curve {dike}"] = path
+    return files
+
+
+def _content_hash(files):
+    """Hash of the names and contents of the data files"""
+    digest = hashlib.sha256()
+    for name, path in sorted(files.items()):
+        digest.update(name.encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_sources(use_cache=True):
+    """Read all data files of the network into a dict of tables.
+
+    With use_cache, the tables are loaded from CACHE_FILE when it was built
+    from data files with the same content, and the cache is (re)written
+    otherwise.
+    """
+    files = _source_files()
+    digest = _content_hash(files)
+
+    if use_cache and os.path.exists(CACHE_FILE):
+        try:
+            cache = pd.read_pickle(CACHE_FILE)
+        except Exception:
+            cache = {}
+        if cache.get("hash") == digest:
+            return cache["tables"]
+
+    tables = {name: _READERS[name.split(" ")[0]](path) for name, path in files.items()}
+
+    if use_cache:
+        # write to a temporary file first, so that processes starting at
+        # the same time never read a half written cache
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_file = f"{CACHE_FILE}.{os.getpid()}"
+        pd.to_pickle({"hash": digest, "tables": tables}, tmp_file)
+        os.replace(tmp_file, CACHE_FILE)
+
+    return tables
+
+
+def get_network(plann_steps_max=10, use_cache=True):
     """Build network uploading crucial parameters"""
+    tables = read_sources(use_cache)
 
     # Upload dike info
-    df = pd.read_excel("./data/dikeIjssel.xlsx", dtype=object)
-    df = df.set_index("NodeName")
+    df = tables["dikes"].set_index("NodeName")
 
     nodes = df.to_dict("index")
 
@@ -28,19 +115,13 @@ def get_network(plann_steps_max=10):
     dike_branches = {k: df[df["branch"] == k].index.values for k in branches}
 
     # Upload fragility curves:
-    frag_curves = pd.read_excel(
-        "./data/fragcurves/frag_curves.xlsx", header=None, index_col=0
-    ).transpose()
-    calibration_factors = pd.read_excel(
-        "./data/fragcurves/calfactors_pf1250.xlsx", index_col=0
-    )
+    frag_curves = tables["frag_curves"].transpose()
+    calibration_factors = tables["calibration_factors"]
 
     # Upload room for the river projects:
     steps = np.array(range(plann_steps_max))
 
-    projects = pd.read_excel(
-        "./data/rfr_strategies.xlsx", index_col=0, names=["project name", 0, 1, 2, 3, 4]
-    )
+    projects = tables["rfr_strategies"]
 
     for n in steps:
         a = to_dict_dropna(projects)
@@ -51,11 +132,11 @@ def get_network(plann_steps_max=10):
         G.add_node(f"discount rate {n}", **{"value": 0})
 
     # Upload evacuation policies:
-    G.add_node("EWS", **pd.read_excel("./data/EWS.xlsx").to_dict())
+    G.add_node("EWS", **tables["EWS"].to_dict())
     G.nodes["EWS"]["type"] = "measure"
 
     # Upload muskingum params:
-    Muskingum_params = pd.read_excel("./data/muskingum/params.xlsx", index_col=0)
+    Muskingum_params = tables["muskingum"]
 
     # Fill network with crucial info:
     for dike in dike_list:
@@ -72,15 +153,13 @@ def get_network(plann_steps_max=10):
         G.nodes[dike]["dikelevel"] = Lookuplin(G.nodes[dike]["f"], 1, 0, 0.5)
 
         # Assign stage-discharge relationships
-        filename = f"./data/rating_curves/{dike}_ratingcurve_new.txt"  # Load file
-        rc_array = np.loadtxt(filename)  # Load file into array
+        rc_array = tables[f"rating_curve {dike}"]  # Loaded file
         G.nodes[dike]["r"] = rc_array[
             rc_array[:, 0].argsort()
         ]  # Sort on first column before saving
 
         # Assign losses per location:
-        name = f"./data/losses_tables/{dike}_lossestable.xlsx"
-        G.nodes[dike]["table"] = pd.read_excel(name, index_col=0).values
+        G.nodes[dike]["table"] = tables[f"losses {dike}"].values
 
         # Assign Muskingum paramters:
         G.nodes[dike]["C1"] = Muskingum_params.loc[G.nodes[dike]["prec_node"], "C1"]
@@ -88,8 +167,223 @@ def get_network(plann_steps_max=10):
         G.nodes[dike]["C3"] = Muskingum_params.loc[G.nodes[dike]["prec_node"], "C3"]
 
     # The plausible 133 upstream wave-shapes:
-    G.nodes["A.0"]["Qevents_shape"] = pd.read_excel(
-        "./data/hydrology/wave_shapes.xls", index_col=0
-    )
+    G.nodes["A.0"]["Qevents_shape"] = tables["wave_shapes"]
 
     return G, dike_list, dike_branches, steps
+
+
+CompiledNetwork = namedtuple(
+    "CompiledNetwork",
+    [
+        "dikes",
+        "prec",
+        "muskingum",
+        "hground",
+        "fragility_tables",
+        "rating_tables",
+        "rc_q",
+        "rc_wl",
+        "rc_slope",
+        "rc_len",
+        "tables",
+        "area_tables",
+        "area_slope",
+        "outcome_tables",
+        "cost_params",
+        "wave_shapes",
+        "wave_response",
+        "initial_response",
+        "rfr_projects",
+        "rfr_costs",
+        "rfr_lowering",
+        "evacuees",
+    ],
+)
+
+
+def _read_only(array):
+    array = np.array(array, dtype=float)
+    array.flags.writeable = False
+    return array
+
+
+def compile_network(G, dike_list):
+    """Compile the static content of the network into read-only arrays,
+    indexed by position in dike_list:
+
+    prec             : index of the preceding dike, -1 for the upstream node
+    muskingum        : Muskingum C1, C2, C3 per dike
+    hground          : ground level per dike
+    fragility_tables : per dike, water level at a failure probability
+    rating_tables    : per dike, water level (column 0) and its running
+                       maximum (column 1) at a discharge; the maximum
+                       bounds the water level at any lower discharge
+    rc_q, rc_wl      : rating curves padded to (dikes, rows), with their
+    rc_slope, rc_len   slopes and the number of valid rows per dike
+    tables           : (dikes, rows, 7) loss tables
+    area_tables      : per dike, floodplain area (column 0 of the loss
+                       table) on column 4, with area_slope the slopes
+    outcome_tables   : per dike, losses, deaths and evacuees (columns 4, 3
+                       and 5 of the loss table) at a water level (column 6)
+
+    The tables are funs_interp.InterpTable instances; the padded arrays of
+    the rating and area tables are those of the compiled kernel.
+    cost_params      : (dikes, 4) traj_ratio, c, b and lambda of cost_fun
+    wave_shapes      : (shapes, time) upstream flood wave shapes
+    wave_response    : (shapes, dikes, time) routed unit response of every
+                       wave shape, see route_unit_responses
+    initial_response : (dikes, time) routed response to a unit initial
+                       discharge
+    rfr_projects     : names of the room for the river projects
+    rfr_costs        : (projects,) costs of the room for the river projects
+    rfr_lowering     : (projects, dikes) water level lowering per project
+    evacuees         : evacuation percentage per days to threat
+    """
+    dikes = tuple(dike_list)
+    nodes = [G.nodes[dike] for dike in dikes]
+
+    prec = np.array(
+        [dikes.index(n["prec_node"]) if n["prec_node"] in dikes else -1 for n in nodes]
+    )
+    prec.flags.writeable = False
+
+    # water level and, as the rating curves are not monotone at low
+    # discharges, its running maximum:
+    rating_tables = []
+    for n in nodes:
+        Q, wl = n["r"][:, 0], n["r"][:, 1]
+        envelope = np.maximum.accumulate(wl)
+        rating_tables.append(
+            funs_interp.InterpTable(Q, np.column_stack([wl, envelope]))
+        )
+    rating_tables = tuple(rating_tables)
+    rc_q, rc_wl, rc_slope, rc_len = funs_interp.pad(rating_tables)
+    rc_len.flags.writeable = False
+
+    tables = _read_only([n["table"] for n in nodes])
+    area_tables = tuple(
+        funs_interp.InterpTable(table[:, 4], table[:, 0]) for table in tables
+    )
+    outcome_tables = tuple(
+        funs_interp.InterpTable(table[:, 6], table[:, [4, 3, 5]]) for table in tables
+    )
+
+    projects = {
+        k: v for k, v in G.nodes["RfR_projects 0"].items() if k not in ("type", "cost")
+    }
+    rfr_lowering = [[p.get(dike, 0) for dike in dikes] for p in projects.values()]
+
+    evacuees = G.nodes["EWS"]["evacuees"]
+
+    muskingum = np.array([[n["C1"], n["C2"], n["C3"]] for n in nodes])
+    wave_shapes = G.nodes["A.0"]["Qevents_shape"].values
+    wave_response, initial_response = route_unit_responses(wave_shapes, prec, muskingum)
+
+    return CompiledNetwork(
+        dikes=dikes,
+        prec=prec,
+        muskingum=_read_only(muskingum),
+        hground=_read_only([n["hground"] for n in nodes]),
+        fragility_tables=tuple(
+            funs_interp.InterpTable(n["f"][:, 1], n["f"][:, 0]) for n in nodes
+        ),
+        rating_tables=rating_tables,
+        rc_q=_read_only(rc_q),
+        rc_wl=_read_only(rc_wl),
+        rc_slope=_read_only(rc_slope),
+        rc_len=rc_len,
+        tables=tables,
+        area_tables=area_tables,
+        area_slope=_read_only(funs_interp.pad(area_tables)[2]),
+        outcome_tables=outcome_tables,
+        cost_params=_read_only(
+            [[n["traj_ratio"], n["c"], n["b"], n["lambda"]] for n in nodes]
+        ),
+        wave_shapes=_read_only(wave_shapes),
+        wave_response=_read_only(wave_response),
+        initial_response=_read_only(initial_response),
+        rfr_projects=tuple(projects),
+        rfr_costs=_read_only([p["costs_1e6"] * 1e6 for p in projects.values()]),
+        rfr_lowering=_read_only(rfr_lowering),
+        evacuees=_read_only([evacuees[d] for d in sorted(evacuees)]),
+    )
+
+
+def route_unit_responses(wave_shapes, prec, muskingum):
+    """Until a dike breaches, Muskingum routing along the dikes is linear in
+    the upstream discharge and in the initial discharge of the event. The
+    inflow at every dike is then
+
+        Qin = Qpeak * wave_response[shape] + Q_0 * initial_response
+
+    with wave_response the routed wave shape (zero initial discharge) and
+    initial_response the routed unit initial discharge (zero upstream wave).
+    """
+    n_dikes = len(prec)
+    n_shapes, n_time = wave_shapes.shape
+
+    # unit inputs: the wave shapes, and a zero wave with initial discharge 1
+    upstream = np.vstack([wave_shapes, np.zeros(n_time)])
+    Qin = np.zeros((n_shapes + 1, n_dikes, n_time))
+    Qin[-1, :, 0] = 1
+
+    for t in range(1, n_time):
+        for n in range(n_dikes):
+            if prec[n] < 0:
+                Qn0_t1, Qn0_t0 = upstream[:, t], upstream[:, t - 1]
+            else:
+                Qn0_t1, Qn0_t0 = Qin[:, prec[n], t], Qin[:, prec[n], t - 1]
+            C1, C2, C3 = muskingum[n]
+            Qin[:, n, t] = C1 * Qn0_t1 + C2 * Qn0_t0 + C3 * Qin[:, n, t - 1]
+
+    return Qin[:-1], Qin[-1]
+
+
+# Policy levers precomputed per lever state, see compile_policy_tables:
+PolicyTables = namedtuple(
+    "PolicyTables",
+    ["max_increase", "heights", "dike_costs", "rfr_costs", "rfr_lowering"],
+)
+
+
+def compile_policy_tables(network, dh, n_steps, max_increase=10):
+    """Tabulate the effect of the policy levers, which take few discrete
+    values: dike increases of 0 to max_increase steps of dh per planning
+    step, and room for the river projects switched on (1) or off (0).
+
+    max_increase : largest DikeIncrease per planning step
+    heights      : (n_steps * max_increase + 1,) cumulative dike height in
+                   meters per number of increase steps; it shifts the
+                   fragility curve, so the critical water level is that of
+                   the original curve plus the height
+    dike_costs   : (dikes, cumulative increase, increase) heightening costs
+                   per dike, from cost_fun
+    rfr_costs    : costs of a planning step per combination of projects,
+                   indexed by the 0/1 state of every project
+    rfr_lowering : (dikes,) lowering of the rating curves per combination,
+                   indexed by the number of steps (0 to n_steps) in which
+                   every project was carried out
+    """
+    n_projects = len(network.rfr_projects)
+
+    heights = np.arange(n_steps * max_increase + 1) * dh
+    increases = heights[: max_increase + 1]
+    dike_costs = np.zeros((len(network.dikes), len(heights), len(increases)))
+    for n, params in enumerate(network.cost_params):
+        dike_costs[n, :, 1:] = cost_fun(*params, heights[:, None], increases[1:])
+
+    rfr_costs = np.zeros((2,) * n_projects)
+    for state in np.ndindex(rfr_costs.shape):
+        rfr_costs[state] = np.dot(state, network.rfr_costs)
+
+    rfr_lowering = np.zeros((n_steps + 1,) * n_projects + (len(network.dikes),))
+    for counts in np.ndindex(rfr_lowering.shape[:-1]):
+        rfr_lowering[counts] = np.dot(counts, network.rfr_lowering)
+
+    return PolicyTables(
+        max_increase=max_increase,
+        heights=_read_only(heights),
+        dike_costs=_read_only(dike_costs),
+        rfr_costs=_read_only(rfr_costs),
+        rfr_lowering=_read_only(rfr_lowering),
+    )
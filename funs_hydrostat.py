@@ -6,30 +6,76 @@ Created on Sun Oct 29 15:55:19 2017
 import random
 import numpy as np
 
-#
 
+class Werklijn:
+    """werklijn: step-wise distribution of high discharges.
 
-def werklijn_cdf(Xlist, A):
-    """werklijn function: step-wise distribution of high discharges"""
+    The discharge X is a piece-wise linear function of the log of the
+    return period: on segment j, which starts at discharge Q[j] and return
+    period RP[j], X = a[j] * log(RP) + b[j], i.e. a Gumbel distribution
+    with P(X) = exp(-exp(-(X - b[j]) / a[j])). Outside the segments, below
+    the first and at an infinite discharge or return period, the
+    distribution is undefined (nan).
+
+    input
+    A:  parameters of the werklijn, with columns Q, RP, a and b and one
+        row per segment in ascending order
+    """
 
-    X = np.asarray(Xlist)
-    nl = np.shape(A)[0]
-    a = A["a"].values
-    b = A["b"].values
+    def __init__(self, A):
+        self.Q, self.RP, self.a, self.b = (
+            np.asarray(A[key], dtype=float) for key in ("Q", "RP", "a", "b")
+        )
+        if np.any(np.diff(self.Q) <= 0) or np.any(np.diff(self.RP) <= 0):
+            raise ValueError("werklijn segments must be in ascending order")
+
+        # upper bounds of the segments:
+        self._Q_bounds = np.append(self.Q, np.inf)
+        self._RP_bounds = np.append(self.RP, np.inf)
+
+    def _segments(self, bounds, x):
+        """Segment of every value of x, and whether it lies on one"""
+        j = np.searchsorted(bounds, x, side="right") - 1
+        valid = (j >= 0) & (j < len(self.a))
+        return np.where(valid, j, 0), valid
+
+    def cdf(self, X):
+        """probability of non-exceedance of the discharges X"""
+        X = np.asarray(X, dtype=float)
+        j, valid = self._segments(self._Q_bounds, X)
+        with np.errstate(over="ignore"):
+            P = np.exp(-np.exp(-(X - self.b[j]) / self.a[j]))
+        return np.where(valid, P, np.nan)
+
+    def inv(self, P):
+        """discharge with probability of non-exceedance P"""
+        P = np.asarray(P, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            RP = 1 / -np.log(P)
+            j, valid = self._segments(self._RP_bounds, RP)
+            X = self.a[j] * np.log(RP) + self.b[j]
+        return np.where(valid, X, np.nan)
+
+    def pdf(self, X):
+        """probability density of the discharges X"""
+        X = np.asarray(X, dtype=float)
+        j, valid = self._segments(self._Q_bounds, X)
+        with np.errstate(over="ignore"):
+            z = np.exp(-(X - self.b[j]) / self.a[j])
+            p = np.exp(-z) * z / self.a[j]
+        return np.where(valid, p, np.nan)
+
+    def sample(self, size, seed=None):
+        """size random discharges, drawn by inverse transform sampling with
+        np.random.default_rng(seed) (or with seed itself, when it is a
+        numpy Generator)"""
+        rng = np.random.default_rng(seed)
+        return self.inv(rng.random(size))
 
-    XL = A["Q"].values
-    XL = np.append(XL, np.inf)
-    # A['Q'].loc[nl + 1] = np.inf
 
-    # P = np.repeat(np.nan, np.size(X))
-    P = np.empty(X.shape)
-    P[:] = np.nan
-    for j in range(0, nl):
-        indexlow = X >= XL[j]
-        indexup = X < XL[j + 1]
-        index = np.where((indexlow * indexup) == True)[0]
-        P[index] = np.exp(-np.exp(-(X[index] - b[j]) / a[j]))
-    return P
+def werklijn_cdf(Xlist, A):
+    """werklijn function: step-wise distribution of high discharges"""
+    return Werklijn(A).cdf(Xlist)
 
 
 def werklijn_inv(Plist, A):
@@ -44,28 +90,7 @@ def werklijn_inv(Plist, A):
     output
     X:    x-value, asociated with P
     """
-
-    P = np.asarray(Plist)
-    nl = np.shape(A)[0]
-    a = A["a"].values
-    b = A["b"].values
-    # A['RP'].loc[nl + 1] = np.inf
-    RPL = A["RP"].values
-    RPL = np.append(RPL, np.inf)
-
-    Fe = -np.log(P)
-    RP = 1 / Fe
-
-    X = np.empty(P.shape)
-    X[:] = np.nan
-    # X = np.repeat(np.nan, np.size(P))
-    for j in range(nl):
-        indexlow = RP >= RPL[j]
-        indexup = RP < RPL[j + 1]
-        index = np.where((indexlow * indexup) == True)[0]
-        X[index] = a[j] * np.log(RP[index]) + b[j]
-
-    return X
+    return Werklijn(A).inv(Plist)
 
 
 def werklijn_pdf(Xlist, A):
@@ -80,28 +105,70 @@ def werklijn_pdf(Xlist, A):
     output
     P:    probability density
     """
-
-    X = np.array(Xlist)
-
-    nl = np.shape(A)[0]
-    a = A["a"].values
-    b = A["b"].values
-    A["Q"].loc[nl + 1] = np.inf
-    XL = A["Q"].values
-
-    # derive P-values
-    P = np.repeat(np.nan, np.size(X))
-    for j in range(0, nl):
-        indexlow = X >= XL[j]
-        indexup = X < XL[j + 1]
-        index = np.where((indexlow * indexup) == True)[0]
-        P[index] = (
-            werklijn_cdf(X[index], A) * np.exp(-(X[index] - b[j]) / a[j]) * (1 / a[j])
-        )
-    return P
+    return Werklijn(A).pdf(Xlist)
 
 
 def rand_werklijn(A):
     """randomly sample from werklijn"""
     u = random.random()
     return werklijn_inv([u], A)
+
+
+# Methods of event_set:
+EVENT_SETS = ("random", "stratified", "gauss")
+
+
+def event_set(A, n_events=30, method="random", seed=None, P=(0.992, 0.99992)):
+    """Set of flood events to integrate the expected annual damage over.
+
+    input
+    A:        parameters of the werklijn, or a Werklijn
+    n_events: number of events
+    method:   'random' draws peak discharges uniformly between the bounds
+              of P (the original model, with np.random when seed is None),
+              'stratified' takes the midpoints of equally wide strata of
+              the probability of exceedence, 'gauss' takes Gauss-Legendre
+              nodes in the log of the return period
+    seed:     seed of the 'random' method
+    P:        probabilities of non-exceedance at Lobith bounding the events
+
+    output
+    Qpeaks:   peak discharges at the model boundary (a sixth of Lobith), in
+              descending order
+    p_exc:    probability of exceedence of every event at Lobith
+    weights:  integration weights, so that e.g. the expected annual damage
+              is np.dot(losses, weights)
+    """
+    werklijn = A if isinstance(A, Werklijn) else Werklijn(A)
+    lowQ, highQ = werklijn.inv(list(P))
+    p_min, p_max = 1 - P[1], 1 - P[0]
+
+    if method == "random":
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        Qpeaks = np.unique(rng.uniform(lowQ, highQ, n_events) / 6)[::-1]
+        p_exc = 1 - werklijn.cdf(Qpeaks * 6)
+        # trapezoidal rule between the highest and lowest event:
+        weights = np.zeros(len(p_exc))
+        weights[1:] += np.diff(p_exc) / 2
+        weights[:-1] += np.diff(p_exc) / 2
+        return Qpeaks, p_exc, weights
+
+    if method == "stratified":
+        edges = np.linspace(p_min, p_max, n_events + 1)
+        p_nodes = (edges[:-1] + edges[1:]) / 2
+        weights = np.diff(edges)
+    elif method == "gauss":
+        # substitute u = log(1 / p), so that dp = -p du:
+        u, w = np.polynomial.legendre.leggauss(n_events)
+        u_min, u_max = np.log(1 / p_max), np.log(1 / p_min)
+        u = u_min + (u + 1) * (u_max - u_min) / 2
+        p_nodes = np.exp(-u)
+        weights = w * (u_max - u_min) / 2 * p_nodes
+    else:
+        raise ValueError(f"unknown event set {method!r}, use one of {EVENT_SETS}")
+
+    Qpeaks = werklijn.inv(1 - p_nodes) / 6
+    order = np.argsort(Qpeaks)[::-1]
+    Qpeaks, weights = Qpeaks[order], weights[order]
+    p_exc = 1 - werklijn.cdf(Qpeaks * 6)
+    return Qpeaks, p_exc, weights
@@ -0,0 +1,80 @@
+"""
+Interpolation tables for the lookups of the dike network model.
+
+An InterpTable interpolates one or more columns of a table on a common
+ascending column, with the same result as np.interp (funs_dikes.Lookuplin)
+per column. The table is checked once, when it is built, and keeps the
+slopes of its segments for the compiled kernel (see funs_kernel._interp),
+which finds the segment of a value once for all columns it needs.
+"""
+import numpy as np
+
+
+class InterpTable:
+    """Piecewise linear interpolation of y on x.
+
+    Parameters
+    ----------
+    x : array_like
+        (rows,) ascending sample points, which may repeat
+    y : array_like
+        (rows,) or (rows, columns) values at the sample points
+
+    Outside the table the first and last rows are returned. Where x repeats,
+    the last of the equal rows applies from that point on, as in np.interp.
+    """
+
+    # arrays that define the table, see from_arrays:
+    arrays = ("x", "y", "slopes")
+
+    def __init__(self, x, y):
+        x = np.array(x, dtype=float)
+        y = np.array(y, dtype=float)
+        if x.ndim != 1 or len(x) < 2:
+            raise ValueError("x must be one dimensional with at least two rows")
+        if len(y) != len(x) or y.ndim > 2:
+            raise ValueError("y must have one row, or one value, per row of x")
+        if np.isnan(x).any() or np.any(np.diff(x) < 0):
+            raise ValueError("x must be in ascending order")
+
+        # slopes of the segments between repeated points are never used:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slopes = np.diff(y, axis=0) / np.diff(x).reshape(-1, *[1] * (y.ndim - 1))
+
+        for array in (x, y, slopes):
+            array.flags.writeable = False
+        self.x, self.y, self.slopes = x, y, slopes
+
+    @classmethod
+    def from_arrays(cls, x, y, slopes):
+        """Table of the arrays of an existing, already checked table"""
+        table = cls.__new__(cls)
+        table.x, table.y, table.slopes = x, y, slopes
+        return table
+
+    def __len__(self):
+        return len(self.x)
+
+    def __call__(self, x_new, column=None):
+        """Interpolate at x_new (any shape), for one column or for all of
+        them, stacked on the last axis of the result"""
+        if column is not None or self.y.ndim == 1:
+            y = self.y if column is None else self.y[:, column]
+            return np.interp(x_new, self.x, y)
+        return np.stack(
+            [np.interp(x_new, self.x, y) for y in self.y.T], axis=np.ndim(x_new)
+        )
+
+
+def pad(tables, column=0):
+    """Stack one column of equally wide tables into (tables, rows) arrays x,
+    y and slopes, padded to the longest table, and the number of rows per
+    table, for the compiled kernel"""
+    lengths = np.array([len(table) for table in tables])
+    x, y, slopes = (np.zeros((len(tables), lengths.max())) for _ in range(3))
+    for i, table in enumerate(tables):
+        x[i, : lengths[i]] = table.x
+        y[i, : lengths[i]] = table.y if table.y.ndim == 1 else table.y[:, column]
+        slope = table.slopes if table.y.ndim == 1 else table.slopes[:, column]
+        slopes[i, : lengths[i] - 1] = slope
+    return x, y, slopes, lengths
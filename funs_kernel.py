@@ -0,0 +1,215 @@
+"""
+Compiled hydraulic time-stepping kernel for the dike network.
+
+The kernel runs Muskingum routing, the rating curve lookup, dike failure,
+the floodplain volume and basin depth updates on the flat typed arrays of
+funs_generate_network.compile_network instead of the networkx graph. It
+only steps the events in which a dike breaches, from the first breach on;
+DikeNetwork derives everything before that from the linear response of the
+network to the wave shapes. The kernel is compiled with numba when that is
+installed; otherwise DikeNetwork falls back to its numpy engine.
+
+Run this file to check that the kernel agrees with the python engines.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+HAS_NUMBA = njit is not None
+
+
+def _interp(x, xp, fp, slopes, m):
+    """np.interp of a scalar on the first m rows of xp and fp, which are
+    sorted in ascending order, with the slopes of the segments precomputed
+    (see funs_interp.InterpTable)"""
+    if x < xp[0]:
+        return fp[0]
+    if x >= xp[m - 1]:
+        return fp[m - 1]
+
+    # binary search for the last j with xp[j] <= x:
+    lo, hi = 0, m - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if xp[mid] <= x:
+            lo = mid
+        else:
+            hi = mid
+    if xp[lo] == x:
+        return fp[lo]
+
+    return slopes[lo] * (x - xp[lo]) + fp[lo]
+
+
+def _step_events(
+    Qupstream,
+    critWL,
+    wl_shift,
+    Bmax,
+    Brate,
+    rc_q,
+    rc_wl,
+    rc_slope,
+    rc_len,
+    prec,
+    muskingum,
+    hground,
+    tables,
+    area_slope,
+    t_start,
+    n_time,
+    timestep,
+    sb,
+    timestepcorr,
+    Qin,
+    wlmax,
+    status,
+    wl_after,
+    tolerance,
+    adaptive,
+):
+    """Advance events of the dike network from time step t_start to n_time.
+
+    Same model as DikeNetwork._step_events, written as scalar loops so that
+    it compiles in nopython mode. The static network arrays are those of
+    funs_generate_network.compile_network. Qupstream is the discharge wave
+    at the upstream boundary, (events, time); the other arrays are shaped
+    (events, dikes). Qin and wlmax hold the state at t_start - 1 when no
+    dike has failed yet; they are updated in place, and the final breach
+    status is written to status.
+
+    When adaptive, an event stops once wl_after (see
+    DikeNetwork._step_events) stays below the critical water level of its
+    intact dikes and within tolerance of the maximum water level of its
+    breached dikes.
+    Returns the number of time steps of all events.
+    """
+    n_events, n_dikes = Qin.shape
+
+    Qout_t0 = np.empty(n_dikes)
+    Qout_t1 = np.empty(n_dikes)
+    cumVol = np.empty(n_dikes)
+    hbas = np.empty(n_dikes)
+    tbreach = np.empty(n_dikes)
+    failed = np.empty(n_dikes, dtype=np.bool_)
+    n_steps = 0
+
+    for k in range(n_events):
+        for n in range(n_dikes):
+            Qout_t1[n] = Qin[k, n]
+            cumVol[n] = 0.0
+            hbas[n] = 0.0
+            tbreach[n] = np.nan
+            failed[n] = False
+
+        # Run over the discharge wave:
+        for t in range(t_start, n_time):
+            simtime = t * timestep
+            for n in range(n_dikes):
+                Qout_t0[n] = Qout_t1[n]
+
+            # Run over each node of the branch, in routing order:
+            for n in range(n_dikes):
+                p = prec[n]
+                if p < 0:
+                    prec_Qout_t1 = Qupstream[k, t]
+                    prec_Qout_t0 = Qupstream[k, t - 1]
+                else:
+                    prec_Qout_t1 = Qout_t1[p]
+                    prec_Qout_t0 = Qout_t0[p]
+
+                # Muskingum routing:
+                Qin[k, n] = (
+                    muskingum[n, 0] * prec_Qout_t1
+                    + muskingum[n, 1] * prec_Qout_t0
+                    + muskingum[n, 2] * Qin[k, n]
+                )
+
+                # Transform Q in water levels:
+                wl = _interp(Qin[k, n], rc_q[n], rc_wl[n], rc_slope[n], rc_len[n])
+                wl -= wl_shift[k, n]
+                if wl > wlmax[k, n]:
+                    wlmax[k, n] = wl
+
+                # Dike failure and flow balance (see dikefailure), with the
+                # basin depth of time t not yet updated:
+                outflow = Qin[k, n]
+                breachflow = 0.0
+                if failed[n]:
+                    h1 = wl - hground[n]
+                    if h1 > 0:
+                        B = Bmax[k, n] * (
+                            1 - np.exp(-Brate[k, n] * (simtime - tbreach[n]))
+                        )
+                        breachflow = 1.7 * B * h1**1.5
+                    outflow = max(0.0, Qin[k, n] - breachflow)
+                elif wl > critWL[k, n]:
+                    failed[n] = True
+                    tbreach[n] = simtime
+
+                if not sb:
+                    outflow = Qin[k, n]
+                Qout_t1[n] = outflow
+
+                # Volume inside the floodplain, running trapezoidal integral
+                # of Q in time up to time t:
+                cumVol[n] += breachflow * timestepcorr
+                vol = cumVol[n]
+                if t == n_time - 1:
+                    vol -= 0.5 * breachflow * timestepcorr
+                Area = _interp(
+                    wl, tables[n, :, 4], tables[n, :, 0], area_slope[n], tables.shape[1]
+                )
+                hbas[n] = vol / Area
+
+            n_steps += 1
+            if adaptive:
+                quiet = True
+                for n in range(n_dikes):
+                    if failed[n]:
+                        quiet = wl_after[k, n, t] <= wlmax[k, n] + tolerance
+                    else:
+                        quiet = wl_after[k, n, t] <= critWL[k, n]
+                    if not quiet:
+                        break
+                if quiet:
+                    break
+
+        for n in range(n_dikes):
+            status[k, n] = failed[n]
+
+    return n_steps
+
+
+if HAS_NUMBA:
+    _interp = njit(cache=True, inline="always")(_interp)
+    step_events = njit(cache=True, nogil=True)(_step_events)
+else:
+    step_events = _step_events
+
+
+def check_parity(n_experiments=20, seed=1361, rtol=1e-9):
+    """Compare the kernel with the vectorized and scalar python engines on
+    random experiments, raising an AssertionError when they disagree"""
+    from dike_model_function import DikeNetwork, sample_experiments
+
+    scalar = DikeNetwork(engine="scalar")
+    compiled = DikeNetwork(engine="compiled")
+    compiled.Qpeaks, compiled.event_weights = scalar.Qpeaks, scalar.event_weights
+
+    experiments = sample_experiments(scalar, n_experiments, seed)
+    batch = compiled.evaluate_batch(experiments)
+    for i, kwargs in enumerate(experiments.to_dict("records")):
+        expected = scalar(**kwargs)
+        result = compiled(**kwargs)
+        for key, values in expected.items():
+            np.testing.assert_allclose(result[key], values, rtol=rtol, err_msg=key)
+            np.testing.assert_allclose(batch[key][i], values, rtol=rtol, err_msg=key)
+
+
+if __name__ == "__main__":
+    check_parity()
+    print(f"kernel agrees with the python engines (numba: {HAS_NUMBA})")
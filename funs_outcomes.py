@@ -0,0 +1,96 @@
+"""
+Preallocated outcome buffers of the dike network model.
+
+The model writes the outcomes of a run into a single float array, laid out
+as (..., outcomes, planning steps) with the outcomes per dike ring first,
+dike by dike in the order of DIKE_METRICS, followed by those of the whole
+network in NETWORK_METRICS. An Outcomes instance wraps that array and gives
+the {'A.3_Expected Annual Damage': values per step, ...} view of the model
+outcomes on top of it, without copying.
+"""
+from collections.abc import Mapping
+
+import numpy as np
+
+DIKE_METRICS = (
+    "Expected Annual Damage",
+    "Expected Number of Deaths",
+    "Dike Investment Costs",
+)
+NETWORK_METRICS = ("RfR Total Costs", "Expected Evacuation Costs")
+
+
+def outcome_names(dikes):
+    """Names of the outcomes of a network of dikes, in buffer order"""
+    names = [f"{dike}_{metric}" for dike in dikes for metric in DIKE_METRICS]
+    return names + list(NETWORK_METRICS)
+
+
+class Outcomes(Mapping):
+    """Outcomes of one or more experiments, as a read-only mapping of
+    outcome names to views on one array.
+
+    Parameters
+    ----------
+    dikes : sequence of str
+    values : ndarray
+             (outcomes, steps) for one experiment or (experiments, outcomes,
+             steps) for several, in the order of outcome_names(dikes)
+    """
+
+    def __init__(self, dikes, values):
+        self.dikes = tuple(dikes)
+        self.names = outcome_names(self.dikes)
+        if values.ndim < 2 or values.shape[-2] != len(self.names):
+            raise ValueError(
+                f"values must be shaped (..., {len(self.names)}, steps), "
+                f"not {values.shape}"
+            )
+        self.values = values
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def empty(cls, dikes, n_steps, n_experiments=None):
+        """Uninitialized buffer for one experiment, or for n_experiments"""
+        shape = (len(outcome_names(dikes)), n_steps)
+        if n_experiments is not None:
+            shape = (n_experiments,) + shape
+        return cls(dikes, np.empty(shape))
+
+    def __reduce__(self):
+        # pickle only the array, e.g. to send results between processes:
+        return Outcomes, (self.dikes, self.values)
+
+    def __getitem__(self, name):
+        return self.values[..., self._index[name], :]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return f"Outcomes({dict(self)!r})"
+
+    @property
+    def per_dike(self):
+        """View (..., dikes, DIKE_METRICS, steps) of the dike outcomes"""
+        n = len(self.dikes) * len(DIKE_METRICS)
+        shape = self.values.shape[:-2] + (len(self.dikes), len(DIKE_METRICS), -1)
+        return self.values[..., :n, :].reshape(shape)
+
+    @property
+    def network(self):
+        """View (..., NETWORK_METRICS, steps) of the network outcomes"""
+        return self.values[..., len(self.dikes) * len(DIKE_METRICS) :, :]
+
+    def sum(self, names):
+        """Sum of the outcomes names over them and the planning steps, per
+        experiment"""
+        index = [self._index[name] for name in names]
+        return self.values[..., index, :].sum(axis=(-2, -1))
+
+    def take(self, experiment):
+        """Outcomes of one experiment of a batch, as a view"""
+        return Outcomes(self.dikes, self.values[experiment])
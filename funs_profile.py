@@ -0,0 +1,145 @@
+"""
+Opt-in per-phase profiling of the dike network model.
+
+With DikeNetwork.enable_profiling, every evaluation adds its wall time per
+phase (see PHASES) to a PhaseProfile. Copies of the model sent to worker
+processes start counting from zero and write their totals, together with
+the event counts of their model, to one json file per process in the
+profile directory, at most every interval seconds and when the process
+exits. The parent reads them back with load or report.
+"""
+import glob
+import json
+import os
+import time
+from collections import Counter
+
+import pandas as pd
+
+# Phases of an evaluation, in the order they run. The array engines bind
+# the parameter columns before the room for the river lookups and evaluate
+# breaches per event after routing; the scalar engine copies the graph
+# first and evaluates breaches inside its routing loop.
+PHASES = (
+    "graph copy",
+    "binding",
+    "rfr init",
+    "heights and costs",
+    "routing",
+    "breach evaluation",
+    "aggregation",
+)
+
+
+class PhaseProfile:
+    """Wall time and number of calls per phase of the model evaluations.
+
+    Parameters
+    ----------
+    directory : str, optional
+                directory to write the totals of this process to, see dump
+    interval : float
+               minimum number of seconds between two writes by maybe_dump
+    """
+
+    def __init__(self, directory=None, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        self.reset()
+
+    def __getstate__(self):
+        return {"directory": self.directory, "interval": self.interval}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+        # not started in this process yet, see DikeNetwork._profiled:
+        self.pid = None
+
+    def reset(self):
+        """Start counting from zero, in the current process"""
+        self.pid = os.getpid()
+        self.seconds = Counter()
+        self.calls = Counter()
+        self._lap = time.perf_counter()
+        self._dumped = self._lap
+
+    def start(self):
+        """Start timing the first phase of an evaluation"""
+        self._lap = time.perf_counter()
+
+    def lap(self, phase):
+        """Add the time since the previous lap (or start) to phase"""
+        now = time.perf_counter()
+        self.seconds[phase] += now - self._lap
+        self.calls[phase] += 1
+        self._lap = now
+
+    def dump(self, counts=None):
+        """Write the totals of this process, and the event counts, to
+        <directory>/profile_<pid>.json"""
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile_{os.getpid()}.json")
+        data = {
+            "seconds": dict(self.seconds),
+            "calls": dict(self.calls),
+            "counts": {key: int(value) for key, value in (counts or {}).items()},
+        }
+        # write and rename, so that a reader never sees half a file:
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+        self._dumped = time.perf_counter()
+
+    def maybe_dump(self, counts=None):
+        """dump, if the last one was more than interval seconds ago"""
+        if time.perf_counter() - self._dumped > self.interval:
+            self.dump(counts)
+
+
+def clear(directory):
+    """Remove the files of an earlier run from directory"""
+    for path in glob.glob(os.path.join(directory, "profile_*.json")):
+        os.remove(path)
+
+
+def load(directory):
+    """Totals over all processes that wrote to directory.
+
+    Returns
+    -------
+    phases : DataFrame
+             seconds, calls and milliseconds per call of every phase
+    counts : Counter
+             event counts of all processes, and their number ('workers')
+    """
+    seconds, calls, counts = Counter(), Counter(), Counter()
+    paths = glob.glob(os.path.join(directory, "profile_*.json"))
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        seconds.update(data["seconds"])
+        calls.update(data["calls"])
+        counts.update(data["counts"])
+    counts["workers"] = len(paths)
+
+    phases = pd.DataFrame(
+        {
+            "seconds": [seconds[phase] for phase in PHASES],
+            "calls": [calls[phase] for phase in PHASES],
+        },
+        index=pd.Index(PHASES, name="phase"),
+    )
+    phases = phases[phases["calls"] > 0]
+    phases["ms per call"] = 1000 * phases["seconds"] / phases["calls"]
+    phases["share"] = phases["seconds"] / phases["seconds"].sum()
+    return phases, counts
+
+
+def report(directory):
+    """Printable summary of load(directory)"""
+    phases, counts = load(directory)
+    lines = [phases.to_string(float_format=lambda x: f"{x:.4g}"), ""]
+    lines += [f"{key:>20}: {counts[key]}" for key in sorted(counts)]
+    return "\n".join(lines)
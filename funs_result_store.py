@@ -0,0 +1,276 @@
+"""
+Persistent store of experiment results, addressed by their content.
+
+Every result is kept under a hash of the model version (the code, data,
+flood events and settings of the model, see DikeNetwork.version), the
+problem formulation (the parameters, constants and outcomes of the
+workbench model) and the values of the uncertainties and levers of the
+experiment. The names of scenarios and policies are left out, so that the
+same pair evaluated in another step of the analysis is found again,
+whatever it is called there.
+
+The evaluators of this module, and ChunkedEvaluator of funs_scheduling,
+look every experiment up in a ResultStore before they run anything, only
+run the ones not found, and store their results as they come in. Results
+are only found again by runs of a model with the same flood events, like
+the models of problem_formulation, which are seeded with its EVENT_SEED; a
+DikeNetwork without an event_seed draws new events in every process. A
+ResultStore opened with the current model version deletes the results of
+all other versions, so that the database does not keep growing as the
+model changes.
+"""
+import abc
+import hashlib
+import inspect
+import json
+import numbers
+import os
+import pickle
+import sqlite3
+
+from ema_workbench import MultiprocessingEvaluator, SequentialEvaluator, ema_logging
+from ema_workbench.em_framework.experiment_runner import ExperimentRunner
+from ema_workbench.em_framework.futures_multiprocessing import add_tasks
+from ema_workbench.em_framework.model import AbstractModel
+from ema_workbench.em_framework.points import experiment_generator
+from ema_workbench.em_framework.util import NamedObjectMap
+
+DEFAULT_PATH = "./data/cache/results.sqlite"
+
+# Results inserted before they are committed to the database:
+_BUFFER_SIZE = 100
+
+
+def _value(value):
+    """Value of an uncertainty or lever as it enters the key: numbers as
+    floats, so that a lever read back from a csv file as 1.0 matches 1"""
+    if isinstance(value, numbers.Number):
+        return repr(float(value))
+    return str(value)
+
+
+def _function_source(function):
+    """Source of an outcome function, or its name if that is unavailable"""
+    if function is None:
+        return None
+    try:
+        return inspect.getsource(function)
+    except (OSError, TypeError):
+        return getattr(function, "__qualname__", repr(function))
+
+
+def formulation_digest(model):
+    """Hash of the problem formulation of a workbench model: its name, the
+    model variables of its uncertainties and levers, its constants and its
+    outcomes, with the code of their functions"""
+    outcomes = [
+        (
+            outcome.name,
+            list(outcome.variable_name),
+            getattr(outcome, "kind", None),
+            _function_source(getattr(outcome, "function", None)),
+        )
+        for outcome in model.outcomes
+    ]
+    parameters = sorted(
+        (p.name, list(p.variable_name))
+        for p in list(model.uncertainties) + list(model.levers)
+    )
+    constants = sorted((c.name, _value(c.value)) for c in model.constants)
+    data = [model.name, parameters, constants, outcomes]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+def model_version(model):
+    """Version of the model function of a workbench model (see
+    DikeNetwork.version), or '' if it has none"""
+    function = getattr(model, "function", None)
+    return function.version() if hasattr(function, "version") else ""
+
+
+def model_digest(model):
+    """Hash of the version of the model function and of the problem
+    formulation"""
+    version = model_version(model)
+    return hashlib.sha256((version + formulation_digest(model)).encode()).hexdigest()
+
+
+def experiment_key(digest, experiment):
+    """Key of an experiment of the model with model_digest digest"""
+    values = {}
+    for point in (experiment.scenario, experiment.policy):
+        values.update({str(k): _value(v) for k, v in point.items()})
+    data = [digest, sorted(values.items())]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+class ResultStore:
+    """Outcomes of experiments by experiment_key, in an sqlite database,
+    with the version of the model (see model_version) they were run with.
+
+    Inserted results are committed in batches and by flush. Several
+    processes can use the same database.
+
+    Parameters
+    ----------
+    path : str
+    version : str, optional
+              the current model version; the results of all other
+              versions are deleted when the store opens
+    """
+
+    def __init__(self, path=DEFAULT_PATH, version=None):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            "(key TEXT PRIMARY KEY, outcomes BLOB, version TEXT)"
+        )
+        columns = [
+            row[1] for row in self._connection.execute("PRAGMA table_info(results)")
+        ]
+        if "version" not in columns:
+            # a database of before the version column
+            self._connection.execute("ALTER TABLE results ADD COLUMN version TEXT")
+        if version is not None:
+            deleted = self._connection.execute(
+                "DELETE FROM results WHERE version IS NOT ?", (version,)
+            ).rowcount
+            if deleted:
+                ema_logging.get_rootlogger().info(
+                    f"{deleted} results of other model versions deleted from {path}"
+                )
+        self._connection.commit()
+        self._pending = []
+
+    def __len__(self):
+        self.flush()
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM results").fetchone()
+        return count
+
+    def lookup(self, keys):
+        """Dict of the keys that are stored, and their outcomes"""
+        self.flush()
+        keys = list(keys)
+        found = {}
+        # in batches, below the limit on the number of sql variables:
+        for i in range(0, len(keys), 500):
+            batch = keys[i : i + 500]
+            rows = self._connection.execute(
+                "SELECT key, outcomes FROM results WHERE key IN "
+                f"({', '.join('?' * len(batch))})",
+                batch,
+            )
+            found.update((key, pickle.loads(blob)) for key, blob in rows)
+        return found
+
+    def insert(self, key, outcomes, version=None):
+        """Store the outcomes dict of an experiment of a model version"""
+        blob = pickle.dumps(dict(outcomes), pickle.HIGHEST_PROTOCOL)
+        self._pending.append((key, blob, version))
+        if len(self._pending) >= _BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Commit the inserted results"""
+        if self._pending:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)", self._pending
+            )
+            self._connection.commit()
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self._connection.close()
+
+
+class StoredResults(abc.ABC):
+    """Evaluator mixin that skips the experiments found in a ResultStore.
+
+    Subclasses run the other experiments with _evaluate.
+
+    Parameters
+    ----------
+    msis : collection of models
+    store : ResultStore, optional
+            without a store, all experiments are run
+    """
+
+    def __init__(self, msis, *args, store=None, **kwargs):
+        super().__init__(msis, *args, **kwargs)
+        self.store = store
+
+    def evaluate_experiments(self, scenarios, policies, callback, combine="factorial"):
+        experiments = list(
+            experiment_generator(scenarios, self._msis, policies, combine=combine)
+        )
+        if self.store is None:
+            self._evaluate(experiments, callback)
+            return
+
+        versions = {model.name: model_version(model) for model in self._msis}
+        digests = {model.name: model_digest(model) for model in self._msis}
+        keys = {
+            experiment.experiment_id: experiment_key(
+                digests[experiment.model_name], experiment
+            )
+            for experiment in experiments
+        }
+        found = self.store.lookup(keys.values())
+        ema_logging.get_rootlogger().info(
+            f"{len(found)} of {len(experiments)} experiments found in "
+            f"{self.store.path}"
+        )
+
+        todo = []
+        for experiment in experiments:
+            outcomes = found.get(keys[experiment.experiment_id])
+            if outcomes is None:
+                todo.append(experiment)
+            else:
+                callback(experiment, outcomes)
+
+        def store_and_callback(experiment, outcomes):
+            self.store.insert(
+                keys[experiment.experiment_id],
+                outcomes,
+                versions[experiment.model_name],
+            )
+            callback(experiment, outcomes)
+
+        try:
+            self._evaluate(todo, store_and_callback)
+        finally:
+            self.store.flush()
+
+    @abc.abstractmethod
+    def _evaluate(self, experiments, callback):
+        """Run the experiments, passing the outcomes of each to
+        callback(experiment, outcomes)"""
+
+
+class StoredSequentialEvaluator(StoredResults, SequentialEvaluator):
+    """SequentialEvaluator that skips the experiments found in store"""
+
+    def _evaluate(self, experiments, callback):
+        models = NamedObjectMap(AbstractModel)
+        models.extend(self._msis)
+
+        cwd = os.getcwd()
+        runner = ExperimentRunner(models)
+        for experiment in experiments:
+            callback(experiment, runner.run_experiment(experiment))
+        runner.cleanup()
+        os.chdir(cwd)
+
+
+class StoredMultiprocessingEvaluator(StoredResults, MultiprocessingEvaluator):
+    """MultiprocessingEvaluator that skips the experiments found in store"""
+
+    def _evaluate(self, experiments, callback):
+        add_tasks(self.n_processes, self._pool, experiments, callback)
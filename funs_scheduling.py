@@ -0,0 +1,220 @@
+"""
+Chunked scheduling of experiments over a multiprocessing pool.
+
+The MultiprocessingEvaluator of the workbench sends every experiment to the
+workers as a task of its own, so that each model run pays for a round trip
+through the pool's queues next to the pickling of its scenario, policy and
+outcomes. ChunkedEvaluator sends them in chunks of experiments instead,
+with a chunk size tuned (by ChunkTuner) to keep that fixed cost per task a
+small fraction of the time the task takes. Experiments are sorted by flood
+wave shape and scenario first, so that the experiments that share flood
+events (the same scenario under several policies) run one after the other
+in the same worker and find them in its event cache.
+"""
+
+import collections
+import math
+import pickle
+import time
+import traceback
+
+from ema_workbench import MultiprocessingEvaluator, ema_logging
+from ema_workbench.em_framework import futures_multiprocessing
+
+from funs_result_store import StoredResults
+
+# Uncertainty of the flood wave shape in problem_formulation:
+WAVE_SHAPE = "A0_ID_flood_wave_shape"
+
+
+def _noop(*args):
+    return None
+
+
+def run_chunk(runner, experiments):
+    """Run a chunk of experiments with an ExperimentRunner.
+
+    Returns the (experiment, outcomes, error) of every experiment, with the
+    traceback as error if it raised, and the seconds spent on the chunk.
+    """
+    start = time.perf_counter()
+    results = []
+    for experiment in experiments:
+        try:
+            # the model refills the same outcomes dict on every run:
+            outcomes = dict(runner.run_experiment(experiment))
+            results.append((experiment, outcomes, None))
+        except Exception:
+            results.append((experiment, None, traceback.format_exc()))
+    return results, time.perf_counter() - start
+
+
+def _run_chunk(experiments):
+    """run_chunk in a worker of the pool, with the experiment runner that
+    the workbench's initializer set up there"""
+    return run_chunk(futures_multiprocessing.experiment_runner, experiments)
+
+
+def deliver(results, callback):
+    """Pass the results of run_chunk to the callback of the evaluator, and
+    log the experiments that failed"""
+    for experiment, outcomes, error in results:
+        if error is None:
+            callback(experiment, outcomes)
+        else:
+            ema_logging.get_rootlogger().error(f"{experiment} failed:\n{error}")
+
+
+def experiment_order(experiment):
+    """Sort key that groups experiments by flood wave shape and scenario"""
+    scenario = experiment.scenario
+    return scenario.get(WAVE_SHAPE, -1), str(scenario.name), experiment.experiment_id
+
+
+class ChunkTuner:
+    """Number of experiments per task, from the measured cost of a task
+    and of an experiment.
+
+    A chunk holds enough experiments for the fixed cost of a task (the
+    round trip of an empty task through the pool) to be at most overhead
+    times the time of its experiments, and at most a balance-th share of
+    the remaining experiments per worker, so that the workers finish
+    together. It never holds fewer than min_size experiments (unless fewer
+    remain), so that neighbouring experiments, which share flood events
+    (see experiment_order), still reach the same worker when a task costs
+    next to nothing.
+
+    Parameters
+    ----------
+    task_seconds : float
+                   fixed cost of a task
+    n_processes : int
+    overhead : float
+    balance : int
+    min_size : int
+    """
+
+    def __init__(self, task_seconds, n_processes, overhead=0.05, balance=4, min_size=4):
+        self.task_seconds = task_seconds
+        self.n_processes = n_processes
+        self.overhead = overhead
+        self.balance = balance
+        self.min_size = min_size
+        # seconds per experiment, running in a worker and pickling:
+        self.run_seconds = None
+        self.ipc_seconds = None
+
+    def update(self, n_experiments, run_seconds, ipc_seconds=None):
+        """Add the measurements of a completed chunk of n_experiments"""
+        seconds = run_seconds / n_experiments
+        if self.run_seconds is None:
+            self.run_seconds = seconds
+        else:
+            self.run_seconds += 0.2 * (seconds - self.run_seconds)
+        if ipc_seconds is not None:
+            self.ipc_seconds = ipc_seconds
+
+    def size(self, remaining):
+        """Experiments in the next chunk, of the remaining ones; min_size
+        until the first chunk is measured"""
+        if self.run_seconds is None:
+            return max(1, min(self.min_size, remaining))
+        per_experiment = self.run_seconds + (self.ipc_seconds or 0)
+        size = math.ceil(self.task_seconds / (self.overhead * per_experiment))
+        share = math.ceil(remaining / (self.balance * self.n_processes))
+        return max(1, min(max(self.min_size, min(size, share)), remaining))
+
+
+class ChunkedEvaluator(StoredResults, MultiprocessingEvaluator):
+    """MultiprocessingEvaluator that sends experiments to the workers in
+    chunks, and skips those found in store.
+
+    Parameters
+    ----------
+    msis : collection of models
+    n_processes : int, optional
+    maxtasksperchild : int, optional
+    chunk_size : int, optional
+                 experiments per task; tuned while running when left out
+    overhead : float
+               share of the time of a task its fixed cost may take, for
+               the tuned chunk size (see ChunkTuner)
+    min_chunk_size : int
+                     smallest tuned chunk size (see ChunkTuner)
+    store : ResultStore, optional
+            see funs_result_store
+    """
+
+    def __init__(
+        self,
+        msis,
+        n_processes=None,
+        maxtasksperchild=None,
+        chunk_size=None,
+        overhead=0.05,
+        min_chunk_size=4,
+        store=None,
+        **kwargs,
+    ):
+        super().__init__(msis, n_processes, maxtasksperchild, store=store, **kwargs)
+        self.chunk_size = chunk_size
+        self.overhead = overhead
+        self.min_chunk_size = min_chunk_size
+        self.task_seconds = None
+
+    def initialize(self):
+        super().initialize()
+        # the cost of a task, from the median round trip of an empty task
+        # through the queues of the pool, once all workers have started:
+        self._pool.map(_noop, [()] * self.n_processes)
+        round_trips = []
+        for _ in range(20):
+            start = time.perf_counter()
+            self._pool.apply_async(_noop).get()
+            round_trips.append(time.perf_counter() - start)
+        self.task_seconds = sorted(round_trips)[len(round_trips) // 2]
+        return self
+
+    def _evaluate(self, experiments, callback):
+        experiments = sorted(experiments, key=experiment_order)
+        tuner = ChunkTuner(
+            self.task_seconds,
+            self.n_processes,
+            self.overhead,
+            min_size=self.min_chunk_size,
+        )
+
+        # keep every worker busy with up to two chunks queued per worker:
+        pending = collections.deque()
+        done = n_tasks = max_size = 0
+        while done < len(experiments) or pending:
+            while done < len(experiments) and len(pending) < 2 * self.n_processes:
+                size = self.chunk_size or tuner.size(len(experiments) - done)
+                chunk = experiments[done : done + size]
+                pending.append(
+                    (len(chunk), self._pool.apply_async(_run_chunk, [chunk]))
+                )
+                n_tasks += 1
+                max_size = max(max_size, len(chunk))
+                done += len(chunk)
+
+            n_experiments, task = pending.popleft()
+            results, run_seconds = task.get()
+
+            ipc_seconds = None
+            if tuner.ipc_seconds is None:
+                # pickling of an experiment and its outcomes, both ways:
+                start = time.perf_counter()
+                pickle.loads(pickle.dumps(results[0], pickle.HIGHEST_PROTOCOL))
+                ipc_seconds = 2 * (time.perf_counter() - start)
+            tuner.update(n_experiments, run_seconds, ipc_seconds)
+
+            deliver(results, callback)
+
+        if tuner.run_seconds is not None:
+            ema_logging.get_rootlogger().info(
+                f"{len(experiments)} experiments in {n_tasks} tasks "
+                f"of up to {max_size}, "
+                f"{1000 * tuner.run_seconds:.3g} ms per experiment, "
+                f"{1000 * self.task_seconds:.3g} ms per task"
+            )
@@ -0,0 +1,123 @@
+"""
+Shared memory for the compiled dike network.
+
+The parent process publishes the read-only arrays of a CompiledNetwork
+(see funs_generate_network.compile_network), or of another namedtuple of
+arrays like the PolicyTables, once in a single multiprocessing.shared_memory
+block. Worker processes attach to that block and get the same namedtuple
+back as numpy views on it, without copying any data.
+"""
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from funs_interp import InterpTable
+
+# Name of the shared memory block, the layout of the arrays in it, the
+# fields of the network that are tuples of arrays or tables (with their
+# length), the other fields and the namedtuple type of the network:
+SharedNetworkHandle = namedtuple(
+    "SharedNetworkHandle", ["name", "layout", "sequences", "other", "type"]
+)
+
+# Shared memory blocks attached in this process, kept open while in use:
+_attached = {}
+
+
+def _is_sequence(value):
+    """Whether value is a tuple of arrays or interpolation tables"""
+    return (
+        isinstance(value, tuple)
+        and len(value) > 0
+        and all(isinstance(item, (np.ndarray, InterpTable)) for item in value)
+    )
+
+
+def _arrays(network):
+    """Flatten the arrays of the network, including those in tuples of
+    arrays and tables, into {key: array}"""
+    arrays = {}
+    for field, value in network._asdict().items():
+        if isinstance(value, np.ndarray):
+            arrays[field] = value
+        elif _is_sequence(value):
+            for i, item in enumerate(value):
+                if isinstance(item, InterpTable):
+                    for name in InterpTable.arrays:
+                        arrays[f"{field} {i} {name}"] = getattr(item, name)
+                else:
+                    arrays[f"{field} {i}"] = item
+    return arrays
+
+
+def publish(network):
+    """Copy the arrays of the network (a CompiledNetwork or another
+    namedtuple) into a new shared memory block.
+
+    Returns the handle to send to workers and the SharedMemory instance,
+    which the publishing process has to close and unlink when done.
+    """
+    arrays = _arrays(network)
+
+    layout = {}
+    offset = 0
+    for key, array in arrays.items():
+        layout[key] = (offset, array.shape, array.dtype.str)
+        # keep every array aligned on 64 bytes
+        offset += -(-array.nbytes // 64) * 64
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for key, array in arrays.items():
+        start, shape, dtype = layout[key]
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view[...] = array
+
+    sequences, other = {}, {}
+    for field, value in network._asdict().items():
+        if _is_sequence(value):
+            sequences[field] = len(value)
+        elif not isinstance(value, np.ndarray):
+            other[field] = value
+    handle = SharedNetworkHandle(shm.name, layout, sequences, other, type(network))
+    _attached[shm.name] = shm
+    return handle, shm
+
+
+def attach(handle):
+    """Network (of the type that was published) of read-only views on the
+    shared memory block of handle"""
+    shm = _attached.get(handle.name)
+    if shm is None:
+        # Processes started by multiprocessing share the resource tracker
+        # of the parent, so attaching does not hand ownership of the block
+        # to this process.
+        shm = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.name] = shm
+
+    views = {}
+    for key, (start, shape, dtype) in handle.layout.items():
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view.flags.writeable = False
+        views[key] = view
+
+    sequences = {}
+    for field, length in handle.sequences.items():
+        items = []
+        for i in range(length):
+            if f"{field} {i}" in views:
+                items.append(views.pop(f"{field} {i}"))
+            else:
+                arrays = (
+                    views.pop(f"{field} {i} {name}") for name in InterpTable.arrays
+                )
+                items.append(InterpTable.from_arrays(*arrays))
+        sequences[field] = tuple(items)
+    return handle.type(**sequences, **views, **handle.other)
+
+
+def release(shm):
+    """Close and remove a shared memory block created by publish"""
+    _attached.pop(shm.name, None)
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,406 @@
+"""
+Experiment runs over several hosts through a pull-based work queue.
+
+WorkQueueEvaluator serves a WorkQueue on the network (a
+multiprocessing.managers server, authenticated with a shared key). Worker
+processes on any number of hosts, started from a checkout of this
+repository with
+
+    python funs_work_queue.py HOST:PORT --authkey KEY --workers N
+
+register with the queue (which sends them the models), pull chunks of
+experiments, run them and return their results. While a worker runs a
+chunk it sends heartbeats; a chunk without one for timeout seconds, e.g.
+of a worker that died or lost its connection, is put back in front of the
+queue for the next worker. The evaluator can start workers on its own
+host too, which is all it takes to try the setup on one machine.
+"""
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from ema_workbench import ema_logging
+from ema_workbench.em_framework.evaluators import BaseEvaluator
+from ema_workbench.em_framework.experiment_runner import ExperimentRunner
+from ema_workbench.em_framework.model import AbstractModel
+from ema_workbench.em_framework.util import NamedObjectMap
+
+from funs_result_store import StoredResults
+from funs_scheduling import ChunkTuner, deliver, experiment_order, run_chunk
+
+# Answer of WorkQueue.pull once the queue is closed:
+STOP = "stop"
+
+# Environment variable with the default key of the queue:
+AUTHKEY_VARIABLE = "WORK_QUEUE_AUTHKEY"
+
+
+class WorkQueue:
+    """Chunks of experiments waiting for a worker or being run by one.
+
+    Workers call register, pull, heartbeat and complete through the queue
+    server; the evaluator puts chunks and takes their results.
+
+    Parameters
+    ----------
+    models : list of AbstractModel
+             sent to every worker that registers
+    timeout : float
+              seconds without a heartbeat after which a chunk is queued
+              again
+    """
+
+    def __init__(self, models, timeout=60.0):
+        self.models = models
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        self._ids = itertools.count()
+        # (chunk, experiments) waiting, [worker, last heartbeat,
+        # experiments] by chunk being run, and the results of completed
+        # chunks not taken yet:
+        self._pending = collections.deque()
+        self._running = {}
+        self._results = collections.deque()
+        self._done = set()
+        self._workers = {}
+        self._closed = False
+
+    def register(self, worker):
+        """Register a worker by name. Returns the models to run and the
+        timeout, within which it has to send heartbeats"""
+        with self._condition:
+            self._workers[worker] = time.monotonic()
+        ema_logging.get_rootlogger().info(f"worker {worker} registered")
+        return self.models, self.timeout
+
+    def pull(self, worker):
+        """Next (chunk, experiments) for worker, None if there is none yet
+        and STOP once the queue is closed"""
+        with self._condition:
+            now = time.monotonic()
+            self._workers[worker] = now
+            if self._closed:
+                return STOP
+            if not self._pending:
+                return None
+            chunk, experiments = self._pending.popleft()
+            self._running[chunk] = [worker, now, experiments]
+            return chunk, experiments
+
+    def heartbeat(self, worker, chunk):
+        """Tell the queue that worker is still running chunk"""
+        with self._condition:
+            now = time.monotonic()
+            self._workers[worker] = now
+            if chunk in self._running and self._running[chunk][0] == worker:
+                self._running[chunk][1] = now
+
+    def complete(self, worker, chunk, results, run_seconds, latency):
+        """Return the results of a chunk (see run_chunk), the seconds spent
+        on it and the round trip time of a message to the queue. Results
+        of a chunk that was completed before, by another worker after it
+        timed out, are dropped."""
+        with self._condition:
+            self._workers[worker] = time.monotonic()
+            if chunk in self._done:
+                return
+            self._done.add(chunk)
+            self._running.pop(chunk, None)
+            self._pending = collections.deque(
+                item for item in self._pending if item[0] != chunk
+            )
+            self._results.append((chunk, results, run_seconds, latency))
+            self._condition.notify_all()
+
+    def put(self, experiments):
+        """Queue a chunk of experiments; returns its id"""
+        with self._condition:
+            chunk = next(self._ids)
+            self._pending.append((chunk, experiments))
+            return chunk
+
+    def take_results(self, timeout=None):
+        """Results of the chunks completed since the last call, waiting up
+        to timeout seconds for one if there are none"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._results, timeout)
+            results = list(self._results)
+            self._results.clear()
+            return results
+
+    def requeue_expired(self):
+        """Put the chunks without a heartbeat for timeout seconds back in
+        front of the queue"""
+        with self._condition:
+            now = time.monotonic()
+            for chunk, (worker, last, experiments) in list(self._running.items()):
+                if now - last > self.timeout:
+                    del self._running[chunk]
+                    self._pending.appendleft((chunk, experiments))
+                    ema_logging.get_rootlogger().warning(
+                        f"chunk {chunk} of worker {worker} timed out, queued again"
+                    )
+
+    def backlog(self):
+        """Number of chunks waiting for a worker"""
+        with self._condition:
+            return len(self._pending)
+
+    def n_workers(self):
+        """Number of workers heard from within the timeout"""
+        with self._condition:
+            now = time.monotonic()
+            return sum(now - last <= self.timeout for last in self._workers.values())
+
+    def close(self):
+        """Send the workers STOP on their next pull"""
+        with self._condition:
+            self._closed = True
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+_ClientManager.register("get_queue")
+
+
+def parse_address(address):
+    """(host, port) of a 'host:port' string"""
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"expected host:port, not {address!r}")
+    return host, int(port)
+
+
+def _heartbeats(queue, worker, chunk, interval, stop):
+    while not stop.wait(interval):
+        queue.heartbeat(worker, chunk)
+
+
+def run_worker(address, authkey, poll=1.0):
+    """Pull and run chunks from the queue at address, (host, port), until
+    it is closed or can no longer be reached"""
+    manager = _ClientManager(address=address, authkey=authkey)
+    manager.connect()
+    queue = manager.get_queue()
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    models, timeout = queue.register(worker)
+
+    msis = NamedObjectMap(AbstractModel)
+    msis.extend(models)
+    runner = ExperimentRunner(msis)
+    try:
+        while True:
+            task = queue.pull(worker)
+            if task == STOP:
+                break
+            if task is None:
+                time.sleep(poll)
+                continue
+
+            chunk, experiments = task
+            stop = threading.Event()
+            beats = threading.Thread(
+                target=_heartbeats,
+                args=(queue, worker, chunk, timeout / 3, stop),
+                daemon=True,
+            )
+            beats.start()
+            try:
+                results, run_seconds = run_chunk(runner, experiments)
+            finally:
+                stop.set()
+                beats.join()
+
+            start = time.perf_counter()
+            queue.heartbeat(worker, chunk)
+            latency = time.perf_counter() - start
+            queue.complete(worker, chunk, results, run_seconds, latency)
+    except (EOFError, ConnectionError):
+        ema_logging.get_rootlogger().info(f"worker {worker}: queue closed")
+    runner.cleanup()
+
+
+class WorkQueueEvaluator(StoredResults, BaseEvaluator):
+    """Evaluator that serves the experiments in chunks on a work queue, to
+    workers on this and other hosts.
+
+    Parameters
+    ----------
+    msis : collection of models
+    address : tuple
+              (host, port) to serve the queue on; port 0 picks a free one.
+              By default only local workers can connect; serve on a
+              public interface, e.g. ('', 50000), for workers on other
+              hosts
+    authkey : bytes, optional
+              key workers need to connect, by default that in the
+              WORK_QUEUE_AUTHKEY environment variable
+    local_workers : int
+                    worker processes to start on this host
+    chunk_size : int, optional
+                 experiments per chunk; tuned while running when left out
+                 (see funs_scheduling.ChunkTuner)
+    timeout : float
+              seconds without a heartbeat after which a chunk is queued
+              again
+    overhead : float
+    worker_timeout : float
+                     seconds without any worker after which the evaluation
+                     fails, rather than wait for workers that never come
+    log_interval : float
+                   seconds between the progress messages of an evaluation
+    store : ResultStore, optional
+            see funs_result_store
+    """
+
+    def __init__(
+        self,
+        msis,
+        address=("127.0.0.1", 0),
+        authkey=None,
+        local_workers=0,
+        chunk_size=None,
+        timeout=60.0,
+        overhead=0.05,
+        worker_timeout=600.0,
+        log_interval=60.0,
+        store=None,
+    ):
+        super().__init__(msis, store=store)
+        if authkey is None:
+            if AUTHKEY_VARIABLE not in os.environ:
+                raise ValueError(f"no authkey given and {AUTHKEY_VARIABLE} not set")
+            authkey = os.environ[AUTHKEY_VARIABLE].encode()
+        self.address = address
+        self.authkey = authkey
+        self.local_workers = local_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.overhead = overhead
+        self.worker_timeout = worker_timeout
+        self.log_interval = log_interval
+        self.queue = None
+
+    def initialize(self):
+        queue = self.queue = WorkQueue(list(self._msis), self.timeout)
+        _ServerManager.register("get_queue", callable=lambda: queue)
+        self._server = _ServerManager(self.address, self.authkey).get_server()
+        self.address = self._server.address
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        ema_logging.get_rootlogger().info(
+            "work queue served on {}:{}".format(*self.address)
+        )
+
+        host, port = self.address
+        if host in ("", "0.0.0.0"):
+            host = "127.0.0.1"
+        self._processes = [
+            multiprocessing.Process(
+                target=run_worker, args=((host, port), self.authkey)
+            )
+            for _ in range(self.local_workers)
+        ]
+        for process in self._processes:
+            process.start()
+        return self
+
+    def finalize(self):
+        self.queue.close()
+        for process in self._processes:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+        stop_event = getattr(self._server, "stop_event", None)
+        if stop_event is not None:
+            stop_event.set()
+        self._server.listener.close()
+
+    def _evaluate(self, experiments, callback):
+        experiments = sorted(experiments, key=experiment_order)
+        queue = self.queue
+        tuner = ChunkTuner(0.0, 1, self.overhead)
+
+        done = finished = 0
+        waiting = set()
+        last_log = no_workers_since = time.monotonic()
+        while done < len(experiments) or waiting:
+            now = time.monotonic()
+            n_workers = queue.n_workers()
+            if n_workers:
+                no_workers_since = now
+            elif now - no_workers_since > self.worker_timeout:
+                raise RuntimeError(
+                    f"no worker on the work queue at {self.address} for "
+                    f"{self.worker_timeout:g} seconds, {finished} of "
+                    f"{len(experiments)} experiments done"
+                )
+            if now - last_log > self.log_interval:
+                ema_logging.get_rootlogger().info(
+                    f"{finished} of {len(experiments)} experiments done, "
+                    f"{n_workers} workers, {queue.backlog()} chunks waiting"
+                )
+                last_log = now
+
+            # keep up to two chunks per worker waiting in the queue:
+            tuner.n_processes = max(1, n_workers)
+            while done < len(experiments) and queue.backlog() < 2 * tuner.n_processes:
+                size = self.chunk_size or tuner.size(len(experiments) - done)
+                waiting.add(queue.put(experiments[done : done + size]))
+                done += size
+
+            results = queue.take_results(timeout=1.0)
+            queue.requeue_expired()
+            for chunk, chunk_results, run_seconds, latency in results:
+                waiting.discard(chunk)
+                # a task costs the messages of its pull and its results:
+                tuner.task_seconds = 2 * latency
+                tuner.update(len(chunk_results), run_seconds)
+                deliver(chunk_results, callback)
+                finished += len(chunk_results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="funs_work_queue",
+        description="Runs workers for the work queue of a WorkQueueEvaluator",
+    )
+    parser.add_argument("address", help="HOST:PORT of the work queue")
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get(AUTHKEY_VARIABLE),
+        help=f"key of the work queue (default: ${AUTHKEY_VARIABLE})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes to start (default: one per core)",
+    )
+    args = parser.parse_args()
+    if args.authkey is None:
+        parser.error(f"give --authkey or set {AUTHKEY_VARIABLE}")
+
+    ema_logging.log_to_stderr(ema_logging.INFO)
+    address = parse_address(args.address)
+    processes = [
+        multiprocessing.Process(
+            target=run_worker, args=(address, args.authkey.encode())
+        )
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -1,9 +1,8 @@
+import argparse
+
 import pandas as pd
 
-from ema_workbench import (
-    MultiprocessingEvaluator,
-    Scenario,
-)
+from ema_workbench import Scenario
 from ema_workbench.em_framework.optimization import (
     EpsilonProgress,
     ArchiveLogger,
@@ -12,10 +11,33 @@ from ema_workbench.em_framework.optimization import (
 )
 from ema_workbench.util import ema_logging
 
+from funs_result_store import (DEFAULT_PATH, ResultStore,
+                               StoredMultiprocessingEvaluator)
+from funs_scheduling import ChunkedEvaluator
 from problem_formulation import get_model_for_problem_formulation
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                        prog='optimization__seeded_fixed_scenario',
+                        description='Searches policies for the selected scenarios')
+    parser.add_argument('--chunked',
+                        action='store_true',
+                        help='send experiments to the workers in chunks')
+    parser.add_argument('--task_size',
+                        type=int,
+                        help='experiments per chunk with --chunked (default: '
+                             'tuned from the measured run and task times)')
+    parser.add_argument('--result_store',
+                        default=DEFAULT_PATH,
+                        help='database of earlier results, which are not '
+                             'run again (default: %(default)s)')
+    parser.add_argument('--no_result_store',
+                        action='store_true',
+                        help='run every experiment, without reading or '
+                             'writing the result store')
+    args = parser.parse_args()
+
     ema_logging.log_to_stderr(ema_logging.INFO)
 
     model, steps = get_model_for_problem_formulation('A4 Only')
@@ -43,7 +65,14 @@ if __name__ == "__main__":
     results = []
     convergences = []
 
-    with MultiprocessingEvaluator(model) as evaluator:
+    store = (None if args.no_result_store
+             else ResultStore(args.result_store, model.function.version()))
+    if args.chunked:
+        evaluator = ChunkedEvaluator(model, chunk_size=args.task_size, store=store)
+    else:
+        evaluator = StoredMultiprocessingEvaluator(model, store=store)
+
+    with evaluator:
         for scenario in scenarios:
             # we run again for 5 seeds
             for i in range(5):
@@ -5,6 +5,7 @@ Created on Wed Mar 21 17:34:11 2018
 edited by Group 15 for EPA1361, 2023
 """
 
+import functools
 import numpy as np
 
 from ema_workbench import (
@@ -15,18 +16,34 @@ from ema_workbench import (
     RealParameter,
 )
 
-from dike_model_function import DikeNetwork  # @UnresolvedImport
+from dike_model_function import DikeNetwork, VectorFunction  # @UnresolvedImport
 
-def sum_over(*args):
-    numbers = []
-    for entry in args:
-        try:
-            value = sum(entry)
-        except TypeError:
-            value = entry
-        numbers.append(value)
 
-    return sum(numbers)
+# Seed of the flood events of the model, so that all scripts, notebooks and
+# their worker processes integrate over the same events, and find each
+# other's results in the result store (see funs_result_store):
+EVENT_SEED = 1361
+
+
+def get_dike_network(event_seed=EVENT_SEED):
+    """Build the DikeNetwork once per process and seed of its flood events
+    (see DikeNetwork.set_events); all problem formulations (and repeated
+    calls from notebooks) share the same instance. With event_seed None
+    every call builds a new network, with a new set of events."""
+    if event_seed is None:
+        return DikeNetwork()
+    return _seeded_dike_network(event_seed)
+
+
+@functools.lru_cache(maxsize=None)
+def _seeded_dike_network(event_seed):
+    return DikeNetwork(event_seed=event_seed)
+
+
+def sum_over(*args):
+    """Sum of outcomes over their planning steps (entries may be arrays,
+    e.g. the views of funs_outcomes.Outcomes, or scalars)"""
+    return sum(np.sum(entry) for entry in args)
 
 
 def sum_over_time(*args):
@@ -35,7 +52,7 @@ def sum_over_time(*args):
     return summed
 
 
-def get_model_for_problem_formulation(problem_formulation_id):
+def get_model_for_problem_formulation(problem_formulation_id, event_seed=EVENT_SEED):
     """Convenience function to prepare DikeNetwork in a way it can be input in the EMA-workbench.
     Specify uncertainties, levers, and outcomes of interest.
 
@@ -44,10 +61,12 @@ def get_model_for_problem_formulation(problem_formulation_id):
     problem_formulation_id : str
                             'A4 Only': Total Cost, Damges, and Deaths and A4 Damages and Deaths
                             'All Dikes': Total Cost, Damages, and Deaths plus Damages and Deaths for each DR
+    event_seed : int, optional
+                 seed of the flood events of the model, see get_dike_network
     """
     
     # Load the model:
-    function = DikeNetwork()
+    function = get_dike_network(event_seed)
     # EMA workbench model:
     dike_model = Model("dikesnet", function=function)
 
@@ -333,5 +352,47 @@ def get_model_for_problem_formulation(problem_formulation_id):
     return dike_model, function.planning_steps
 
 
+def get_vector_function(problem_formulation_id, reference=None):
+    """Flat vector version of get_model_for_problem_formulation, for
+    optimizers that evaluate one parameter vector at a time.
+
+    Parameters
+    ----------
+    problem_formulation_id : str
+                             see get_model_for_problem_formulation
+    reference : dict or Scenario, optional
+                values of the uncertainties and levers (by their names in
+                the problem formulation, e.g. 'A1_Bmax') that are held
+                fixed, e.g. a reference scenario when searching over levers
+
+    Returns
+    -------
+    VectorFunction
+        maps a vector of the other uncertainties and levers, in the order
+        they are declared, to a vector of the outcomes of the problem
+        formulation; the names are in its parameters and outcome_names
+    """
+    dike_model, _ = get_model_for_problem_formulation(problem_formulation_id)
+    reference = dict(reference or {})
+
+    parameters, fixed = [], {}
+    for parameter in list(dike_model.uncertainties) + list(dike_model.levers):
+        (variable,) = parameter.variable_name
+        if parameter.name in reference:
+            fixed[variable] = reference.pop(parameter.name)
+        else:
+            parameters.append(variable)
+    if reference:
+        raise KeyError(f"unknown parameters {sorted(reference)}")
+
+    outcomes = []
+    for outcome in dike_model.outcomes:
+        if outcome.function is not sum_over:
+            raise ValueError(f"outcome {outcome.name} is not a sum of model outcomes")
+        outcomes.append((outcome.name, outcome.variable_name))
+
+    return VectorFunction(get_dike_network(), parameters, outcomes, fixed)
+
+
 if __name__ == "__main__":
     get_model_for_problem_formulation(3)
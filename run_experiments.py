@@ -1,14 +1,23 @@
 import argparse
+import contextlib
+import os
+import numpy as np
 import pandas as pd
 
 from ema_workbench import (
     Policy,
     Scenario,
     ema_logging,
-    MultiprocessingEvaluator,
     save_results,
 )
-
+from ema_workbench.em_framework.samplers import sample_uncertainties
+
+import funs_profile
+from funs_scheduling import ChunkedEvaluator
+from funs_work_queue import WorkQueueEvaluator, parse_address
+from funs_checkpoint import CheckpointStore, design_digest
+from funs_result_store import (DEFAULT_PATH, ResultStore,
+                               StoredMultiprocessingEvaluator)
 from problem_formulation import get_model_for_problem_formulation
 
 ema_logging.log_to_stderr(ema_logging.INFO)
@@ -26,7 +35,63 @@ if __name__ == "__main__":
                         type=int,
                         default=0,
                         required=False)
+    parser.add_argument('--shared_memory',
+                        action='store_true',
+                        help='publish the network data once in shared memory '
+                             'for all workers')
+    parser.add_argument('--profile',
+                        metavar='DIRECTORY',
+                        help='record the time per model phase and the event '
+                             'counts of every worker in this directory, and '
+                             'report their totals at the end of the run')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=1361,
+                        help='seed of the sampled scenarios and of the '
+                             'flood events of the model')
+    parser.add_argument('--chunk_size',
+                        type=int,
+                        default=1000,
+                        help='scenarios per checkpoint')
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='continue an interrupted run from its '
+                             'checkpoints, running only the missing '
+                             'experiments')
+    parser.add_argument('--chunked',
+                        action='store_true',
+                        help='send experiments to the workers in chunks, '
+                             'grouped by flood wave shape and scenario')
+    parser.add_argument('--task_size',
+                        type=int,
+                        help='experiments per chunk with --chunked or '
+                             '--work_queue (default: tuned from the measured '
+                             'run and task times)')
+    parser.add_argument('--result_store',
+                        default=DEFAULT_PATH,
+                        help='database of earlier results, which are not '
+                             'run again (default: %(default)s)')
+    parser.add_argument('--no_result_store',
+                        action='store_true',
+                        help='run every experiment, without reading or '
+                             'writing the result store')
+    parser.add_argument('--work_queue',
+                        metavar='HOST:PORT',
+                        help='serve the experiments on a work queue at this '
+                             'address, for workers started on any host with '
+                             'python funs_work_queue.py HOST:PORT')
+    parser.add_argument('--local_workers',
+                        type=int,
+                        default=0,
+                        help='worker processes to start on this host with '
+                             '--work_queue')
+    parser.add_argument('--authkey',
+                        help='key of the work queue (default: '
+                             '$WORK_QUEUE_AUTHKEY)')
     args = parser.parse_args()
+    if args.work_queue and args.shared_memory:
+        parser.error('--shared_memory cannot be used with --work_queue, '
+                     'as workers on other hosts cannot attach to it')
 
     # Currently, this file can run in 3 modes:
     #  base_case    : this runs N (100000) scenarios under the "do nothing" policy
@@ -42,7 +107,8 @@ if __name__ == "__main__":
     # Set parameters for experiments based on program mode
     if args.mode == 'base_case':
             
-        dike_model, planning_steps = get_model_for_problem_formulation('All Dikes')
+        dike_model, planning_steps = get_model_for_problem_formulation(
+            'All Dikes', event_seed=args.seed)
 
         # "Do Nothing" case
         policies = []
@@ -54,7 +120,8 @@ if __name__ == "__main__":
 
     elif args.mode == 'robustness':
 
-        dike_model, planning_steps = get_model_for_problem_formulation('A4 Only')
+        dike_model, planning_steps = get_model_for_problem_formulation(
+            'A4 Only', event_seed=args.seed)
 
         # 50 policies from file
         policies_df = pd.read_csv('./output/policies__constraints_filtered__diverse_set_50.csv',
@@ -72,7 +139,8 @@ if __name__ == "__main__":
 
     elif args.mode == 'vulnerability':
 
-        dike_model, planning_steps = get_model_for_problem_formulation('All Dikes')
+        dike_model, planning_steps = get_model_for_problem_formulation(
+            'All Dikes', event_seed=args.seed)
 
         # ~3-7 policies from final Robustness analysis
         policies_df = pd.read_csv('./output/policies__final_set.csv',
@@ -92,15 +160,81 @@ if __name__ == "__main__":
         for name, scenario in scenarios_df.iterrows():
             scenarios.append(Scenario(str(name), **scenario.to_dict()))
 
-    # Perform actual experiment run using the EMA workbench
-    if scenarios is not None:
-        with MultiprocessingEvaluator(dike_model) as evaluator:
-            results = evaluator.perform_experiments(scenarios, policies)
-        N_scenarios = len(scenarios)
-    else:
-        with MultiprocessingEvaluator(dike_model) as evaluator:
-            results = evaluator.perform_experiments(N_scenarios, policies)
-
-    # Save results to an output file
+    # Sample the scenarios up front, with a fixed seed, so that a resumed
+    # run plans the same experiments
+    if scenarios is None:
+        np.random.seed(args.seed)
+        scenarios = [Scenario(i, **dict(scenario)) for i, scenario in
+                     enumerate(sample_uncertainties(dike_model, N_scenarios))]
+    N_scenarios = len(scenarios)
+
+    # Results are written to the checkpoint directory in chunks of
+    # scenarios as they complete, and merged into one file at the end. The
+    # directory only outlives a run that did not finish
     filename = f'./output/{args.mode}_results__{N_scenarios}_scenarios.tar.gz'
-    save_results(results, filename)
\ No newline at end of file
+    checkpoint_dir = filename.replace('.tar.gz', '__checkpoints')
+    design = {'mode': args.mode,
+              'scenarios': N_scenarios,
+              'policies': [policy.name for policy in policies],
+              'seed': args.seed,
+              'digest': design_digest(scenarios, policies),
+              'model': dike_model.function.version()}
+    if os.path.exists(checkpoint_dir) and not args.resume:
+        raise SystemExit(f'{checkpoint_dir} exists: continue that run with '
+                         '--resume, or remove it to start over')
+    store = CheckpointStore(checkpoint_dir, design)
+
+    completed = store.completed()
+    todo = [scenario for scenario in scenarios
+            if any((scenario.name, policy.name) not in completed
+                   for policy in policies)]
+    ema_logging.get_rootlogger().info(
+        f'{N_scenarios - len(todo)} of {N_scenarios} scenarios done in '
+        f'{checkpoint_dir}, {len(todo)} to run')
+
+    # Optionally share the network data with the workers instead of giving
+    # each its own copy. The model is warmed up here so that the workers
+    # start from a compiled kernel cache.
+    if args.shared_memory:
+        dike_model.function.warm_up()
+        network_context = dike_model.function.shared_memory()
+    else:
+        network_context = contextlib.nullcontext()
+
+    if args.profile:
+        dike_model.function.enable_profiling(args.profile)
+
+    # Experiments evaluated before, in this or another run, are read from
+    # the result store instead of run again
+    result_store = (None if args.no_result_store
+                    else ResultStore(args.result_store,
+                                     dike_model.function.version()))
+    if args.work_queue:
+        authkey = args.authkey.encode() if args.authkey else None
+        evaluator = WorkQueueEvaluator(dike_model,
+                                       parse_address(args.work_queue),
+                                       authkey,
+                                       local_workers=args.local_workers,
+                                       chunk_size=args.task_size,
+                                       store=result_store)
+    elif args.chunked:
+        evaluator = ChunkedEvaluator(dike_model, chunk_size=args.task_size,
+                                     store=result_store)
+    else:
+        evaluator = StoredMultiprocessingEvaluator(dike_model,
+                                                   store=result_store)
+
+    # Perform actual experiment run using the EMA workbench, one chunk of
+    # scenarios at a time
+    with network_context, evaluator:
+        for i in range(0, len(todo), args.chunk_size):
+            chunk = todo[i:i + args.chunk_size]
+            store.append(evaluator.perform_experiments(chunk, policies))
+
+    # Save results to an output file; the checkpoints are no longer
+    # needed, and a rerun of the same design starts afresh
+    save_results(store.merge(), filename)
+    store.remove()
+
+    if args.profile:
+        print(funs_profile.report(args.profile))
\ No newline at end of file